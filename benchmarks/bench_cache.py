@@ -0,0 +1,47 @@
+"""
+Benchmark RoboCache bookkeeping: store 1M entries with `max_age` set and
+report the cost per store.
+
+    PYTHONPATH=. python benchmarks/bench_cache.py
+"""
+
+import time
+import datetime
+
+from robobrowser.cache import RoboCache
+
+
+N_ENTRIES = 1000000
+
+
+class FakeResponse(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.status_code = 200
+
+
+def main():
+    responses = [
+        FakeResponse('http://robobrowser.com/page{0}/'.format(idx))
+        for idx in range(N_ENTRIES)
+    ]
+    cases = [
+        ('max_age=1h (nothing expires)', dict(max_age=datetime.timedelta(hours=1))),
+        ('max_age=1ms (constant expiry)',
+         dict(max_age=datetime.timedelta(milliseconds=1))),
+        ('max_age=1h, max_count=10000',
+         dict(max_age=datetime.timedelta(hours=1), max_count=10000)),
+    ]
+    for label, kwargs in cases:
+        cache = RoboCache(**kwargs)
+        start = time.time()
+        for response in responses:
+            cache.store(response)
+        elapsed = time.time() - start
+        print('{0:<32} {1:8.3f}s  {2:6.2f}us/store  ({3} entries)'.format(
+            label, elapsed, elapsed / N_ENTRIES * 1e6, len(cache.data)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Benchmark browser history bookkeeping: navigate 100k pages without network
+access and report the cost per navigation.
+
+    PYTHONPATH=. python benchmarks/bench_history.py
+"""
+
+import time
+
+import requests
+
+from robobrowser import RoboBrowser
+
+
+N_PAGES = 100000
+
+
+def make_response(idx):
+    response = requests.Response()
+    response.url = 'http://robobrowser.com/page{0}/'.format(idx)
+    response.status_code = 200
+    response._content = b''
+    return response
+
+
+def navigate(browser, responses, back_every=None):
+    start = time.time()
+    for idx, response in enumerate(responses):
+        browser._update_state(response)
+        if back_every and idx % back_every == 0 and browser._cursor > 0:
+            browser.back()
+    return time.time() - start
+
+
+def main():
+    responses = [make_response(idx) for idx in range(N_PAGES)]
+    cases = [
+        ('unbounded history', dict(history=True), None),
+        ('history=1000', dict(history=1000), None),
+        ('no history', dict(history=False), None),
+        ('unbounded, back() every 10 pages', dict(history=True), 10),
+    ]
+    for label, kwargs, back_every in cases:
+        browser = RoboBrowser(**kwargs)
+        elapsed = navigate(browser, responses, back_every=back_every)
+        print('{0:<36} {1:8.3f}s  {2:8.2f}us/page  ({3} states)'.format(
+            label, elapsed, elapsed / N_PAGES * 1e6, len(browser._states)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark hit latency of a RoboCache on a shared SQLite storage while
+several processes read and write it at once. Each process reads pages
+through a warm cache, storing pages it misses, and stores a fresh page
+every `WRITE_EVERY` lookups, so the count limit keeps evicting across
+processes. Lookup latencies are reported per number of processes.
+
+    PYTHONPATH=. python benchmarks/bench_shared_cache.py
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+import requests
+
+from robobrowser.cache import RoboCache
+from robobrowser.backends import SQLiteStorage
+
+
+N_PAGES = 1000
+N_LOOKUPS = 2000
+WRITE_EVERY = 10
+BODY = b'<html>' + b'<p>queen</p>' * 500 + b'</html>'
+
+
+def make_response(url):
+    response = requests.Response()
+    response.url = url
+    response.status_code = 200
+    response.encoding = 'utf-8'
+    response._content = BODY
+    return response
+
+
+def page_url(idx):
+    return 'http://robobrowser.com/page{0}/'.format(idx)
+
+
+def worker(path, worker_id, results):
+    cache = RoboCache(
+        storage=SQLiteStorage(path, shared=True), max_count=N_PAGES * 2)
+    requests_ = [
+        requests.Request('GET', page_url(idx % N_PAGES)).prepare()
+        for idx in range(worker_id, worker_id + N_LOOKUPS)
+    ]
+    latencies, misses = [], 0
+    try:
+        for idx, request in enumerate(requests_):
+            start = time.time()
+            response = cache.retrieve(request)
+            latencies.append(time.time() - start)
+            if response is None:
+                misses += 1
+                cache.store(make_response(request.url))
+            if idx % WRITE_EVERY == 0:
+                cache.store(make_response(
+                    'http://robobrowser.com/new/{0}/{1}'.format(
+                        worker_id, idx)))
+    finally:
+        cache.data.close()
+        results.put((latencies, misses))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    tempdir = tempfile.mkdtemp()
+    try:
+        for processes in (1, 4, 16, 32):
+            path = os.path.join(tempdir, 'cache{0}.db'.format(processes))
+            cache = RoboCache(storage=SQLiteStorage(path, shared=True))
+            for idx in range(N_PAGES):
+                cache.store(make_response(page_url(idx)))
+            cache.data.close()
+            results = multiprocessing.Queue()
+            workers = [
+                multiprocessing.Process(
+                    target=worker, args=(path, worker_id, results))
+                for worker_id in range(processes)
+            ]
+            start = time.time()
+            for process in workers:
+                process.start()
+            latencies, misses = [], 0
+            for _ in workers:
+                worker_latencies, worker_misses = results.get()
+                latencies.extend(worker_latencies)
+                misses += worker_misses
+            for process in workers:
+                process.join()
+            elapsed = time.time() - start
+            print('{0:>3} processes  p50 {1:7.3f}ms  p99 {2:7.3f}ms  '
+                  '{3:8.0f} lookups/s  {4:5.1%} misses'.format(
+                      processes,
+                      percentile(latencies, 0.5) * 1e3,
+                      percentile(latencies, 0.99) * 1e3,
+                      len(latencies) / elapsed,
+                      misses / float(len(latencies))))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,11 @@
 __version__ = '0.5.3'
 
+from .compat import PY35
 from .browser import RoboBrowser
+from .pool import RoboBrowserPool
 
-__all__ = ['RoboBrowser']
+__all__ = ['RoboBrowser', 'RoboBrowserPool']
+
+if PY35:
+    from .aio import AsyncRoboBrowser  # noqa
+    __all__.append('AsyncRoboBrowser')
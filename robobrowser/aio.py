@@ -0,0 +1,146 @@
+"""
+Asyncio-native robotic browser.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+from robobrowser.browser import RoboBrowser, RoboState
+
+
+class AsyncRoboBrowser(RoboBrowser):
+    """
+    Robotic web browser with awaitable navigation methods. Requests are sent
+    on the browser's `requests.Session` from a pool of worker threads, so one
+    event loop can drive many navigations at once. History, forms, caching
+    and retries behave exactly as in `RoboBrowser`; states are appended to
+    history in the order their responses arrive. `open_many` and
+    `follow_links` are awaitable as well.
+
+    Unless a session is passed in, the session's adapters keep up to
+    `max_workers` connections per host, so concurrent requests to one host
+    reuse connections instead of discarding them. Size the adapters of a
+    session you pass in yourself.
+
+    :param int max_workers: Maximum number of requests in flight
+    :param kwargs: Keyword arguments to `RoboBrowser`
+
+    """
+    def __init__(self, max_workers=100, **kwargs):
+        super(AsyncRoboBrowser, self).__init__(**kwargs)
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        if kwargs.get('session') is None:
+            self._size_adapters(max_workers)
+
+    def _size_adapters(self, maxsize):
+        """Grow the connection pools of the session's adapters to `maxsize`
+        connections per host, keeping their retry and cache settings.
+
+        """
+        for adapter in set(self.session.adapters.values()):
+            if not isinstance(adapter, HTTPAdapter):
+                continue
+            if adapter._pool_maxsize >= maxsize:
+                continue
+            adapter.poolmanager.clear()
+            adapter._pool_maxsize = maxsize
+            adapter.init_poolmanager(
+                adapter._pool_connections, maxsize,
+                block=adapter._pool_block)
+
+    def __repr__(self):
+        return super(AsyncRoboBrowser, self).__repr__().replace(
+            '<RoboBrowser', '<AsyncRoboBrowser', 1)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shut down worker threads, then close the history store and the
+        session.
+
+        """
+        self.executor.shutdown(wait=False)
+        super(AsyncRoboBrowser, self).close()
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking callable on the worker pool.
+
+        :param func: Callable to run
+        :return: Return value of `func`
+
+        """
+        loop = getattr(
+            asyncio, 'get_running_loop', asyncio.get_event_loop)()
+        call = functools.partial(func, *args, **kwargs)
+        return await loop.run_in_executor(self.executor, call)
+
+    async def open(self, url, method='get', **kwargs):
+        """
+        Open a URL.
+
+        :param str url: URL to open
+        :param str method: Optional method; defaults to `'get'`
+        :param kwargs: Keyword arguments to `Session::request`
+
+        """
+        response = await self._run(
+            self.session.request, method, url,
+            **self._build_send_args(**kwargs))
+        self._update_state(response)
+
+    async def _open_detached(self, urls, method='get', max_workers=10,
+                             **kwargs):
+        """Fetch full URLs concurrently without touching history. Backs the
+        awaitable `open_many` and `follow_links`.
+
+        """
+        send_args = self._build_send_args(**kwargs)
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def fetch(url):
+            async with semaphore:
+                return await self._run(
+                    self.session.request, method, url, **send_args)
+
+        responses = await asyncio.gather(*[fetch(url) for url in urls])
+        return [RoboState(self, response) for response in responses]
+
+    async def follow_link(self, link, **kwargs):
+        """Click a link.
+
+        :param Tag link: Link to click
+        :param kwargs: Keyword arguments to `Session::send`
+
+        """
+        await self.open(self._build_link_url(link), **kwargs)
+
+    async def submit_form(self, form, submit=None, **kwargs):
+        """Submit a form.
+
+        :param Form form: Filled-out form object
+        :param Submit submit: Optional `Submit` to click, if form includes
+            multiple submits
+        :param kwargs: Keyword arguments to `Session::send`
+
+        """
+        method, url, send_args = self._build_form_request(
+            form, submit=submit, **kwargs)
+        response = await self._run(
+            self.session.request, method, url, **send_args)
+        self._update_state(response)
+
+    async def download(self, link, save_path, **kwargs):
+        """Download a file to disk without blocking the event loop. See
+        `RoboBrowser::download`.
+
+        """
+        return await self._run(
+            super(AsyncRoboBrowser, self).download, link, save_path, **kwargs)
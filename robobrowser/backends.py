@@ -0,0 +1,578 @@
+"""
+Storage backends for `RoboCache`. A backend maps cache keys to entries:
+dicts holding the `date` the response was stored, the `response` itself,
+and any bookkeeping the cache adds. Keys iterate in storage order, least
+recently used first.
+
+Bodies are content-addressed: entries with byte-identical bodies share one
+stored blob, which is reference counted and freed with its last entry.
+"""
+
+import json
+import time
+import hashlib
+import contextlib
+import sqlite3
+import datetime
+import threading
+
+from robobrowser.compat import (
+    MutableMapping, OrderedDict, string_types, unichr,
+)
+from robobrowser.store import (
+    CachedResponse, serialize_response, build_response,
+)
+
+
+def body_digest(body):
+    """Content hash of a body.
+
+    :param bytes body: Response body
+    :return: Hex digest
+
+    """
+    return hashlib.sha1(body).hexdigest()
+
+
+def _body_attr(response):
+    """Name of the attribute holding a response's stored body, or None if
+    the body isn't available as bytes.
+
+    """
+    if isinstance(response, CachedResponse) and response._content is False:
+        return 'packed'
+    if isinstance(getattr(response, '_content', None), bytes):
+        return '_content'
+    return None
+
+
+def _timestamp(value):
+    return time.mktime(value.timetuple()) + value.microsecond / 1e6
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': _timestamp(value)}
+    if isinstance(value, datetime.timedelta):
+        return {'__timedelta__': value.total_seconds()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if '__datetime__' in value:
+            return datetime.datetime.fromtimestamp(value['__datetime__'])
+        if '__timedelta__' in value:
+            return datetime.timedelta(seconds=value['__timedelta__'])
+    return value
+
+
+def encode_entry(entry):
+    """Split a cache entry into JSON metadata and body bytes.
+
+    :param dict entry: Cache entry
+    :return: Tuple of (metadata string, body bytes)
+
+    """
+    meta = dict(
+        (key, _encode_value(value))
+        for key, value in entry.items()
+        if key != 'response'
+    )
+    meta['response'], body = serialize_response(entry['response'])
+    return json.dumps(meta), body
+
+
+def decode_entry(meta, body=None):
+    """Rebuild a cache entry from `encode_entry` output. Without a body, the
+    entry is returned without a response.
+
+    """
+    meta = json.loads(meta)
+    response_meta = meta.pop('response')
+    entry = dict(
+        (key, _decode_value(value))
+        for key, value in meta.items()
+    )
+    if body is not None:
+        entry['response'] = build_response(response_meta, bytes(body))
+    return entry
+
+
+class BaseStorage(MutableMapping):
+    """Interface for cache backends. Subclasses implement the mapping
+    methods; `popitem`, `touch` and `iter_meta` have generic implementations that
+    backends may override for speed.
+
+    """
+    #: Whether entries survive the process
+    persistent = False
+
+    #: Whether other processes may change entries concurrently. The cache
+    #: can't keep an accurate index of a shared storage, so it has the
+    #: storage enforce limits through `enforce`
+    shared = False
+
+    #: Number of distinct stored bodies
+    blob_count = 0
+
+    #: Total size of distinct stored bodies, in bytes
+    blob_bytes = 0
+
+    def popitem(self, last=True):
+        """Remove and return the newest (`last`) or oldest entry.
+
+        :return: Tuple of (key, entry)
+
+        """
+        keys = iter(self) if not last else reversed(list(self))
+        try:
+            key = next(keys)
+        except StopIteration:
+            raise KeyError('Storage is empty')
+        entry = self[key]
+        del self[key]
+        return key, entry
+
+    def touch(self, key):
+        """Move an entry to the end of storage order, marking it most
+        recently used.
+
+        """
+        self[key] = self.pop(key)
+
+    def iter_meta(self):
+        """Iterate over (key, entry) pairs in storage order, with entries
+        stripped of their responses.
+
+        """
+        for key in list(self):
+            entry = dict(self[key])
+            entry.pop('response', None)
+            yield key, entry
+
+    def iter_prefix(self, prefix):
+        """Iterate over (key, entry) pairs whose string keys start with
+        `prefix`, with entries stripped of their responses.
+
+        """
+        for key, entry in self.iter_meta():
+            if isinstance(key, string_types) and key.startswith(prefix):
+                yield key, entry
+
+    def enforce(self, max_count=None, max_bytes=None, min_date=None):
+        """Evict entries stored before `min_date`, then least recently used
+        entries until at most `max_count` entries and `max_bytes` of
+        entry sizes remain. Required for shared storages.
+
+        :return: List of evicted keys
+
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStorage(BaseStorage):
+    """Keep live response objects in an in-process ordered dict. Responses
+    with identical bodies are made to share a single bytes object.
+
+    """
+    def __init__(self):
+        self._data = OrderedDict()
+        # Blobs by digest as [body, refs], and the digest of each key
+        self._blobs = {}
+        self._digests = {}
+
+    @property
+    def blob_count(self):
+        return len(self._blobs)
+
+    @property
+    def blob_bytes(self):
+        return sum(len(body) for body, _ in self._blobs.values())
+
+    def _acquire(self, key, entry):
+        response = entry.get('response')
+        attr = _body_attr(response)
+        if attr is None:
+            return
+        body = getattr(response, attr)
+        digest = body_digest(body)
+        blob = self._blobs.get(digest)
+        if blob is None:
+            blob = self._blobs[digest] = [body, 0]
+        else:
+            setattr(response, attr, blob[0])
+        blob[1] += 1
+        self._digests[key] = digest
+
+    def _release(self, key):
+        digest = self._digests.pop(key, None)
+        if digest is None:
+            return
+        blob = self._blobs[digest]
+        blob[1] -= 1
+        if not blob[1]:
+            del self._blobs[digest]
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, entry):
+        self._release(key)
+        self._acquire(key, entry)
+        self._data[key] = entry
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._release(key)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def popitem(self, last=True):
+        key, entry = self._data.popitem(last=last)
+        self._release(key)
+        return key, entry
+
+    def touch(self, key):
+        try:
+            self._data.move_to_end(key)
+        except AttributeError:
+            # Python 2 `OrderedDict` has no `move_to_end`
+            self._data[key] = self._data.pop(key)
+
+    def iter_meta(self):
+        for key, entry in list(self._data.items()):
+            yield key, entry
+
+    def clear(self):
+        self._data.clear()
+        self._blobs.clear()
+        self._digests.clear()
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Persist entries in a SQLite database, so a cache survives restarts.
+    Status, headers and body are stored; responses are rebuilt on every
+    read and carry no request or redirect history. Bodies live in a
+    `blobs` table keyed by content hash and shared between entries.
+
+    With `shared`, the database is opened in write-ahead-log mode so that
+    many processes can use it at once: readers don't block writers, and
+    writers wait for each other up to `timeout` seconds. Count, size and
+    age limits are then enforced inside the database, from running totals
+    kept by triggers. Updating recency on a hit is skipped when another
+    process holds the write lock, so eviction order is approximate.
+
+    :param str path: Path to the database file
+    :param bool shared: Allow concurrent use by several processes
+    :param float timeout: Seconds to wait for another writer's lock
+
+    """
+    persistent = True
+
+    def __init__(self, path, shared=False, timeout=30):
+        self.path = path
+        self.shared = shared
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        # Transactions are managed explicitly; see `_transaction`
+        self._conn = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None,
+            check_same_thread=False)
+        if shared:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._transaction():
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key PRIMARY KEY, seq INTEGER, meta TEXT, hash TEXT, '
+                'date REAL, size INTEGER)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS entries_seq ON entries (seq)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS blobs ('
+                'hash PRIMARY KEY, refs INTEGER, body BLOB)'
+            )
+            self._migrate()
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS entries_date ON entries (date)'
+            )
+            self._create_totals()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run statements in a write transaction. The write lock is taken
+        up front, so concurrent processes queue instead of failing to
+        upgrade a read lock.
+
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def _migrate(self):
+        """Upgrade tables written by older versions: move inline bodies
+        into `blobs`, and add the columns used to enforce limits.
+
+        """
+        columns = [
+            row[1] for row in
+            self._conn.execute('PRAGMA table_info(entries)').fetchall()
+        ]
+        for column, kind in (('date', 'REAL'), ('size', 'INTEGER')):
+            if column not in columns:
+                self._conn.execute(
+                    'ALTER TABLE entries ADD COLUMN {0} {1}'.format(
+                        column, kind))
+        if 'hash' in columns:
+            return
+        self._conn.execute('ALTER TABLE entries ADD COLUMN hash TEXT')
+        rows = self._conn.execute(
+            'SELECT key, body FROM entries WHERE body IS NOT NULL').fetchall()
+        for key, body in rows:
+            digest = self._acquire(bytes(body))
+            self._conn.execute(
+                'UPDATE entries SET hash = ?, body = NULL WHERE key = ?',
+                (digest, key))
+
+    def _create_totals(self):
+        """Keep the count and total size of entries in a one-row table, so
+        limits are checked without scanning `entries`.
+
+        """
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS totals ('
+            'id INTEGER PRIMARY KEY, count INTEGER, bytes INTEGER)'
+        )
+        self._conn.execute(
+            'INSERT OR IGNORE INTO totals (id, count, bytes) '
+            'SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+        )
+        self._conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS entries_insert '
+            'AFTER INSERT ON entries BEGIN '
+            'UPDATE totals SET count = count + 1, '
+            'bytes = bytes + COALESCE(NEW.size, 0); END'
+        )
+        self._conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS entries_delete '
+            'AFTER DELETE ON entries BEGIN '
+            'UPDATE totals SET count = count - 1, '
+            'bytes = bytes - COALESCE(OLD.size, 0); END'
+        )
+        self._conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS entries_resize '
+            'AFTER UPDATE OF size ON entries BEGIN '
+            'UPDATE totals SET bytes = bytes - COALESCE(OLD.size, 0) + '
+            'COALESCE(NEW.size, 0); END'
+        )
+
+    def __repr__(self):
+        return '<SQLiteStorage path={0!r}>'.format(self.path)
+
+    @property
+    def blob_count(self):
+        return self._query('SELECT COUNT(*) FROM blobs')[0][0]
+
+    @property
+    def blob_bytes(self):
+        return self._query(
+            'SELECT COALESCE(SUM(LENGTH(body)), 0) FROM blobs')[0][0]
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _acquire(self, body):
+        """Add a reference to a body's blob, storing it if new. Must be
+        called within `_transaction`.
+
+        :return: Content hash
+
+        """
+        digest = body_digest(body)
+        updated = self._conn.execute(
+            'UPDATE blobs SET refs = refs + 1 WHERE hash = ?', (digest, )
+        ).rowcount
+        if not updated:
+            self._conn.execute(
+                'INSERT INTO blobs (hash, refs, body) VALUES (?, 1, ?)',
+                (digest, sqlite3.Binary(body)))
+        return digest
+
+    def _release(self, key):
+        """Drop the blob reference held by an entry, freeing the blob with
+        its last reference. Must be called within `_transaction`.
+
+        :return: Whether the entry exists
+
+        """
+        rows = self._conn.execute(
+            'SELECT hash FROM entries WHERE key = ?', (key, )).fetchall()
+        if not rows:
+            return False
+        digest = rows[0][0]
+        self._conn.execute(
+            'UPDATE blobs SET refs = refs - 1 WHERE hash = ?', (digest, ))
+        self._conn.execute(
+            'DELETE FROM blobs WHERE hash = ? AND refs <= 0', (digest, ))
+        return True
+
+    def __getitem__(self, key):
+        rows = self._query(
+            'SELECT entries.meta, blobs.body FROM entries '
+            'JOIN blobs ON blobs.hash = entries.hash '
+            'WHERE entries.key = ?', (key, ))
+        if not rows:
+            raise KeyError(key)
+        return decode_entry(*rows[0])
+
+    def __setitem__(self, key, entry):
+        meta, body = encode_entry(entry)
+        date = _timestamp(entry['date']) if entry.get('date') else None
+        with self._transaction():
+            # Take the new reference first, so a body shared with the
+            # replaced entry isn't freed in between
+            digest = self._acquire(body)
+            self._release(key)
+            # Replacing an entry keeps its position, like a dict
+            updated = self._conn.execute(
+                'UPDATE entries SET meta = ?, hash = ?, date = ?, size = ? '
+                'WHERE key = ?',
+                (meta, digest, date, entry.get('size', 0), key)
+            ).rowcount
+            if not updated:
+                self._conn.execute(
+                    'INSERT INTO entries (key, seq, meta, hash, date, size) '
+                    'VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 '
+                    'FROM entries), ?, ?, ?, ?)',
+                    (key, meta, digest, date, entry.get('size', 0))
+                )
+
+    def __delitem__(self, key):
+        with self._transaction():
+            if not self._release(key):
+                raise KeyError(key)
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key, ))
+
+    def touch(self, key):
+        sql = (
+            'UPDATE entries SET seq = '
+            '(SELECT MAX(seq) + 1 FROM entries) WHERE key = ?'
+        )
+        if not self.shared:
+            with self._transaction():
+                self._conn.execute(sql, (key, ))
+            return
+        # Best effort: a hit shouldn't queue behind other processes' writes
+        with self._lock:
+            self._conn.execute('PRAGMA busy_timeout = 0')
+            try:
+                self._conn.execute(sql, (key, ))
+            except sqlite3.OperationalError:
+                pass
+            finally:
+                self._conn.execute('PRAGMA busy_timeout = {0}'.format(
+                    int(self.timeout * 1000)))
+
+    def __contains__(self, key):
+        return bool(self._query(
+            'SELECT 1 FROM entries WHERE key = ?', (key, )))
+
+    def __iter__(self):
+        rows = self._query('SELECT key FROM entries ORDER BY seq')
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM entries')[0][0]
+
+    def popitem(self, last=True):
+        order = 'DESC' if last else 'ASC'
+        with self._transaction():
+            rows = self._conn.execute(
+                'SELECT entries.key, entries.meta, blobs.body FROM entries '
+                'JOIN blobs ON blobs.hash = entries.hash '
+                'ORDER BY entries.seq {0} LIMIT 1'.format(order)
+            ).fetchall()
+            if not rows:
+                raise KeyError('Storage is empty')
+            key, meta, body = rows[0]
+            self._release(key)
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key, ))
+        return key, decode_entry(meta, body)
+
+    def enforce(self, max_count=None, max_bytes=None, min_date=None):
+        evicted = []
+        with self._transaction():
+            if min_date is not None:
+                evicted.extend(row[0] for row in self._conn.execute(
+                    'SELECT key FROM entries WHERE date < ?',
+                    (_timestamp(min_date), )).fetchall())
+                for key in evicted:
+                    self._delete(key)
+            while max_count or max_bytes:
+                count, total = self._conn.execute(
+                    'SELECT count, bytes FROM totals').fetchone()
+                excess = 0
+                if max_count and count > max_count:
+                    excess = count - max_count
+                elif max_bytes and total > max_bytes:
+                    excess = 1
+                if not excess:
+                    break
+                keys = [row[0] for row in self._conn.execute(
+                    'SELECT key FROM entries ORDER BY seq LIMIT ?',
+                    (excess, )).fetchall()]
+                for key in keys:
+                    self._delete(key)
+                evicted.extend(keys)
+        return evicted
+
+    def _delete(self, key):
+        """Delete an entry and its blob reference. Must be called within
+        `_transaction`.
+
+        """
+        self._release(key)
+        self._conn.execute('DELETE FROM entries WHERE key = ?', (key, ))
+
+    def iter_meta(self):
+        rows = self._query('SELECT key, meta FROM entries ORDER BY seq')
+        for key, meta in rows:
+            yield key, decode_entry(meta)
+
+    def iter_prefix(self, prefix):
+        # A range over the primary key, rather than a scan
+        upper = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+        rows = self._query(
+            'SELECT key, meta FROM entries WHERE key >= ? AND key < ?',
+            (prefix, upper))
+        for key, meta in rows:
+            yield key, decode_entry(meta)
+
+    def clear(self):
+        with self._transaction():
+            self._conn.execute('DELETE FROM entries')
+            self._conn.execute('DELETE FROM blobs')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
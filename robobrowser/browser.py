@@ -2,45 +2,149 @@
 Robotic browser.
 """
 
+import copy
 import re
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 from werkzeug import cached_property
 from requests.packages.urllib3.util.retry import Retry
 
 from robobrowser import helpers
 from robobrowser import exceptions
-from robobrowser.compat import urlparse
+from robobrowser.compat import OrderedDict, urlparse, itervalues, string_types
 from robobrowser.forms.form import Form
-from robobrowser.cache import RoboHTTPAdapter
+from robobrowser.cache import RoboHTTPAdapter, PolicyMatcher, ArtifactCache
+from robobrowser.store import StateStore
+from robobrowser.backends import body_digest
+from robobrowser.download import (
+    DEFAULT_CHUNK_SIZE, download_all, segmented_download, stream_download
+)
 
 
 _link_ptn = re.compile(r'^(a|button)$', re.I)
 _form_ptn = re.compile(r'^form$', re.I)
 
 
+# Rough memory estimates used by `history_max_bytes`: fixed cost of a state
+# and its response object, and size of a parsed tree per byte of HTML
+_STATE_OVERHEAD = 1024
+_PARSED_SIZE_FACTOR = 10
+
+
 class RoboState(object):
     """Representation of a browser state. Wraps the browser and response, and
-    lazily parses the response content.
+    lazily parses the response content. States spilled to the browser's
+    history store reload their response on access.
 
     """
 
     def __init__(self, browser, response):
         self.browser = browser
-        self.response = response
+        self._response = response
         self.url = response.url
+        self.body_released = False
+        # Position in browser history and record in the history store
+        self._seq = None
+        self._record = None
+        # Body hash, for looking up shared artifacts
+        self._digest = None
+
+    @property
+    def response(self):
+        if self._response is None:
+            self._response = self.browser._history_store.load(self._record)
+            self.browser._state_reloaded(self)
+        return self._response
+
+    def artifact(self, kind, build):
+        """Get an artifact derived from the response body from the browser's
+        artifact cache, building it on a miss. Without an artifact cache,
+        the artifact is simply built.
+
+        :param str kind: Artifact kind
+        :param build: Function returning the artifact
 
-    @cached_property
-    def parsed(self):
-        """
-        Lazily parse response content, using HTML parser specified by the
-        browser.
         """
+        cache = self.browser.artifact_cache
+        if cache is None or (self._digest is None and self.body_released):
+            return build()
+        if self._digest is None:
+            self._digest = body_digest(self.response.content or b'')
+        return cache.get(
+            self._digest, self.browser.parser, kind, build,
+            encoding=self.response.encoding)
+
+    def _parse(self):
+        if self.body_released:
+            raise exceptions.RoboError(
+                'Response body was dropped from history to save memory')
         return BeautifulSoup(
             self.response.content,
             features=self.browser.parser,
             from_encoding=self.response.encoding)
 
+    @cached_property
+    def parsed(self):
+        """
+        Lazily parse response content, using HTML parser specified by the
+        browser. With an artifact cache, pages with identical bodies share
+        one parsed tree.
+        """
+        parsed = self.artifact('parsed', self._parse)
+        # Cache before notifying the browser, so the tree is accounted for
+        self.__dict__['parsed'] = parsed
+        self.browser._state_parsed(self)
+        return parsed
+
+    @property
+    def is_parsed(self):
+        return 'parsed' in self.__dict__
+
+    @property
+    def is_spilled(self):
+        return self._response is None
+
+    @property
+    def body_size(self):
+        content = getattr(self._response, '_content', None)
+        if isinstance(content, bytes):
+            return len(content)
+        return 0
+
+    @property
+    def size(self):
+        """Approximate memory held by this state, in bytes."""
+        size = _STATE_OVERHEAD + len(self.url or '') + self.body_size
+        if self.is_parsed:
+            size += self.body_size * _PARSED_SIZE_FACTOR
+        return size
+
+    def release_parsed(self):
+        """Drop the parsed tree; it is rebuilt on next access."""
+        self.__dict__.pop('parsed', None)
+
+    def release_body(self):
+        """Drop the parsed tree and the response body."""
+        self.release_parsed()
+        self._response._content = None
+        self.body_released = True
+
+    def spill(self, store):
+        """Drop the parsed tree and response, writing the response to `store`
+        unless it is already there; it is reloaded on next access.
+
+        :param StateStore store: History store
+
+        """
+        if self.is_spilled or self.body_released:
+            return
+        if self._record is None:
+            self._record = store.append(self._response)
+        self.release_parsed()
+        self._response = None
+
 
 class RoboBrowser(object):
     """
@@ -62,14 +166,49 @@ class RoboBrowser(object):
     :param str user_agent: Default user-agent
     :param history: History length; infinite if True, 1 if falsy, else
         takes integer value
+    :param int history_max_bytes: Approximate memory budget for history.
+        When exceeded, parsed trees of pages other than the current one are
+        dropped first (and re-parsed on demand), then response bodies, then
+        the oldest states. With a history store, bodies are spilled to disk
+        instead of dropped
+    :param str history_path: Path of an append-only file to spill history
+        to. States further than `history_resident` pages from the current
+        page are written there and reloaded on access. The file is emptied
+        when the browser starts; call `close` to release it
+    :param int history_resident: Number of pages on either side of the
+        current page kept in memory when `history_path` is set
 
     :param int timeout: Default timeout, in seconds
     :param bool allow_redirects: 
 
-    :param bool cache: Cache responses
-    :param list cache_patterns: List of URL patterns for cache
+    :param bool cache: Cache responses. May also be a ready-made
+        `cache.RoboCache` or `cache.TieredCache`, used as-is
+    :param list cache_patterns: List of URL patterns for cache, or a dict
+        (or list of pairs) mapping URL prefixes and compiled regular
+        expressions to `cache.CachePolicy` objects; see
+        `cache.PolicyMatcher`
     :param timedelta max_age: Max age for cache
     :param int max_count: Max count for cache
+    :param int max_bytes: Max total size of cached bodies, in bytes
+    :param BaseStorage cache_storage: Storage backend for cache, e.g.
+        `backends.SQLiteStorage` to keep the cache across restarts
+    :param bool cache_respect_headers: Cache according to HTTP headers
+        (`Cache-Control`, `Expires` and `Vary`) rather than caching every
+        successful GET
+    :param timedelta stale_while_revalidate: How long past expiry cached
+        pages are still served while being refreshed in the background
+    :param str cache_compression: Compress cached bodies with `'zlib'` or
+        `'lzma'`
+    :param cache_normalize: Normalize URLs into cache keys: `True` or a
+        `cache.KeyNormalizer`, or a function from URL to key
+    :param dict cache_negative_ttls: Cache error responses briefly, mapping
+        status codes or classes (`'4xx'`, `'5xx'`) to timedeltas; 429 and
+        503 responses use their `Retry-After` header when present
+
+    :param ArtifactCache artifact_cache: Cache of parsed trees, links and
+        forms shared by pages with identical bodies; `True` for a
+        `cache.ArtifactCache` with default settings. May be shared between
+        browsers
 
     :param int tries: Number of retries
     :param Exception errors: Exception or tuple of exceptions to catch
@@ -80,7 +219,11 @@ class RoboBrowser(object):
     def __init__(self, session=None, parser="lxml", user_agent=None,
                  history=True, timeout=None, allow_redirects=True, cache=False,
                  cache_patterns=None, max_age=None, max_count=None, tries=None,
-                 multiplier=None):
+                 multiplier=None, history_max_bytes=None, history_path=None,
+                 history_resident=10, cache_storage=None, max_bytes=None,
+                 cache_respect_headers=False, stale_while_revalidate=None,
+                 cache_compression=None, cache_normalize=None,
+                 artifact_cache=None, cache_negative_ttls=None):
                      
         """
         Parameters
@@ -96,13 +239,27 @@ class RoboBrowser(object):
             self.session.headers['User-Agent'] = user_agent
 
         self.parser = parser
+        self.artifact_cache = (
+            ArtifactCache() if artifact_cache is True else artifact_cache)
 
         self.timeout = timeout
         self.allow_redirects = allow_redirects
 
         # Set up caching
         if cache:
-            adapter = RoboHTTPAdapter(max_age=max_age, max_count=max_count)
+            # Patterns mapped to policies are matched by the adapter itself
+            policies = None
+            if isinstance(cache_patterns, (dict, PolicyMatcher)) or any(
+                    isinstance(pattern, tuple)
+                    for pattern in cache_patterns or ()):
+                policies, cache_patterns = cache_patterns, None
+            adapter = RoboHTTPAdapter(
+                max_age=max_age, max_count=max_count, max_bytes=max_bytes,
+                storage=cache_storage, respect_headers=cache_respect_headers,
+                stale_while_revalidate=stale_while_revalidate,
+                compression=cache_compression, normalize=cache_normalize,
+                negative_ttls=cache_negative_ttls, policies=policies,
+                cache=cache if hasattr(cache, 'retrieve') else None)
             cache_patterns = cache_patterns or ['http://', 'https://']
             for pattern in cache_patterns:
                 self.session.mount(pattern, adapter)
@@ -112,6 +269,27 @@ class RoboBrowser(object):
         elif max_count:
             raise ValueError('Parameter `max_count` is provided, '
                              'but caching is turned off')
+        elif max_bytes:
+            raise ValueError('Parameter `max_bytes` is provided, '
+                             'but caching is turned off')
+        elif cache_storage is not None:
+            raise ValueError('Parameter `cache_storage` is provided, '
+                             'but caching is turned off')
+        elif cache_respect_headers:
+            raise ValueError('Parameter `cache_respect_headers` is provided, '
+                             'but caching is turned off')
+        elif stale_while_revalidate:
+            raise ValueError('Parameter `stale_while_revalidate` is provided, '
+                             'but caching is turned off')
+        elif cache_compression:
+            raise ValueError('Parameter `cache_compression` is provided, '
+                             'but caching is turned off')
+        elif cache_normalize:
+            raise ValueError('Parameter `cache_normalize` is provided, '
+                             'but caching is turned off')
+        elif cache_negative_ttls:
+            raise ValueError('Parameter `cache_negative_ttls` is provided, '
+                             'but caching is turned off')
 
         # Configure history
         self.history = history
@@ -121,9 +299,23 @@ class RoboBrowser(object):
             self._maxlen = 1
         else:
             self._maxlen = history
-        self._states = []
+        self._states = deque(maxlen=self._maxlen)
         self._cursor = -1
 
+        # Memory accounting for history; only active with a budget
+        self.history_max_bytes = history_max_bytes
+        self._history_bytes = 0
+        self._sized_states = {}
+        self._parsed_states = OrderedDict()
+        self._body_states = OrderedDict()
+
+        # Spill history outside the resident window to disk
+        self._history_store = (
+            StateStore(history_path, truncate=True) if history_path else None)
+        self.history_resident = history_resident
+        self._resident_states = OrderedDict()
+        self._state_seq = 0
+
         # Set up retries
         if tries:
             retry = Retry(tries, backoff_factor=multiplier)
@@ -136,6 +328,21 @@ class RoboBrowser(object):
         except exceptions.RoboError:
             return '<RoboBrowser>'
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the history store and the session. Spilled states can't be
+        reloaded afterwards.
+
+        """
+        if self._history_store is not None:
+            self._history_store.close()
+        self.session.close()
+
     @property
     def state(self):
         if self._cursor == -1:
@@ -248,6 +455,55 @@ class RoboBrowser(object):
         response = self.session.request(method, url, **self._build_send_args(**kwargs))
         self._update_state(response)
 
+    def _resolve_url(self, url):
+        """Resolve URL against the current page, if there is one.
+
+        :param str url: Full or partial URL
+        :return: Full URL if the browser has a state, else `url`
+
+        """
+        if self._cursor == -1:
+            return url
+        return self._build_url(url)
+
+    def _open_detached(self, urls, method='get', max_workers=10, **kwargs):
+        """Fetch full URLs concurrently without touching history.
+
+        :param list urls: Full URLs to open
+        :param str method: HTTP verb
+        :param int max_workers: Maximum number of concurrent requests
+        :param kwargs: Keyword arguments to `Session::request`
+        :return: List of `RoboState`, in the order of `urls`
+
+        """
+        send_args = self._build_send_args(**kwargs)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self.session.request, method, url, **send_args)
+                for url in urls
+            ]
+            return [
+                RoboState(self, future.result())
+                for future in futures
+            ]
+
+    def open_many(self, urls, method='get', max_workers=10, **kwargs):
+        """
+        Open several URLs concurrently. Relative URLs are resolved against
+        the current page. The returned states are detached: history and the
+        current page are left unchanged.
+
+        :param list urls: URLs to open
+        :param str method: Optional method; defaults to `'get'`
+        :param int max_workers: Maximum number of concurrent requests
+        :param kwargs: Keyword arguments to `Session::request`
+        :return: List of `RoboState`, in the order of `urls`
+
+        """
+        urls = [self._resolve_url(url) for url in urls]
+        return self._open_detached(
+            urls, method=method, max_workers=max_workers, **kwargs)
+
     def _update_state(self, response):
         """Update the state of the browser. Create a new state object, and
         append to or overwrite the browser's state history.
@@ -255,20 +511,148 @@ class RoboBrowser(object):
         :param requests.MockResponse: New response object
 
         """
-        # Clear trailing states
-        self._states = self._states[:self._cursor + 1]
-
-        # Append new state
+        # Clear trailing states; each state is popped at most once, so this
+        # is amortized O(1) per navigation
+        while len(self._states) > self._cursor + 1:
+            self._untrack_state(self._states.pop())
+        # Keep sequence numbers contiguous, so they map to deque indexes
+        if self._states:
+            self._state_seq = self._states[-1]._seq + 1
+
+        # Append new state; the deque drops leading states beyond `_maxlen`
+        if self._maxlen and len(self._states) == self._maxlen:
+            self._untrack_state(self._states[0])
         state = RoboState(self, response)
+        state._seq = self._state_seq
+        self._state_seq += 1
         self._states.append(state)
-        self._cursor += 1
+        self._cursor = len(self._states) - 1
+        self._track_state(state)
+        self._spill_history()
+        self._reduce_history()
 
-        # Clear leading states
-        if self._maxlen:
-            decrement = len(self._states) - self._maxlen
-            if decrement > 0:
-                self._states = self._states[decrement:]
-                self._cursor -= decrement
+    def _track_state(self, state):
+        """Start accounting for the memory held by a state in history.
+
+        :param RoboState state: New state
+
+        """
+        if self._history_store is not None:
+            self._resident_states[id(state)] = state
+        if self.history_max_bytes is None:
+            return
+        size = state.size
+        self._sized_states[id(state)] = size
+        self._history_bytes += size
+        if state.body_size:
+            self._body_states[id(state)] = state
+        if state.is_parsed:
+            self._parsed_states[id(state)] = state
+
+    def _untrack_state(self, state):
+        """Stop accounting for a state leaving history.
+
+        :param RoboState state: Removed state
+
+        """
+        state._seq = None
+        self._resident_states.pop(id(state), None)
+        size = self._sized_states.pop(id(state), None)
+        if size is None:
+            return
+        self._history_bytes -= size
+        self._body_states.pop(id(state), None)
+        self._parsed_states.pop(id(state), None)
+
+    def _resize_state(self, state):
+        """Update accounting after a state was parsed or released.
+
+        :param RoboState state: State in history
+
+        """
+        size = state.size
+        self._history_bytes += size - self._sized_states[id(state)]
+        self._sized_states[id(state)] = size
+
+    def _state_parsed(self, state):
+        """Called by `RoboState` after parsing, so the tree is counted against
+        the history budget. Detached states are ignored.
+
+        """
+        if id(state) not in self._sized_states:
+            return
+        self._resize_state(state)
+        self._parsed_states[id(state)] = state
+        self._reduce_history()
+
+    def _state_reloaded(self, state):
+        """Called by `RoboState` after reloading a spilled response.
+
+        """
+        if state._seq is None:
+            return
+        if self._history_store is not None:
+            self._resident_states[id(state)] = state
+        if id(state) in self._sized_states:
+            self._resize_state(state)
+            self._body_states[id(state)] = state
+
+    def _spill_state(self, state):
+        """Write a state in history to the history store and update
+        accounting.
+
+        """
+        state.spill(self._history_store)
+        self._resident_states.pop(id(state), None)
+        self._parsed_states.pop(id(state), None)
+        self._body_states.pop(id(state), None)
+        if id(state) in self._sized_states:
+            self._resize_state(state)
+
+    def _spill_history(self):
+        """Spill resident states outside the window of `history_resident`
+        pages around the cursor. Only resident states are visited, so the
+        cost does not grow with the length of history.
+
+        """
+        if self._history_store is None or self._cursor == -1:
+            return
+        base = self._states[0]._seq
+        for state in list(itervalues(self._resident_states)):
+            if abs(state._seq - base - self._cursor) > self.history_resident:
+                self._spill_state(state)
+
+    def _reduce_history(self):
+        """Enforce `history_max_bytes`: drop parsed trees of non-current
+        states, then response bodies, then the oldest states.
+
+        """
+        budget = self.history_max_bytes
+        if budget is None or self._history_bytes <= budget:
+            return
+        current = self.state
+
+        for stage, states in [('parsed', self._parsed_states),
+                              ('body', self._body_states)]:
+            for state in list(itervalues(states)):
+                if self._history_bytes <= budget:
+                    return
+                if state is current:
+                    continue
+                if stage == 'parsed':
+                    state.release_parsed()
+                elif self._history_store is not None:
+                    self._spill_state(state)
+                    continue
+                else:
+                    state.release_body()
+                    self._body_states.pop(id(state))
+                self._parsed_states.pop(id(state), None)
+                self._resize_state(state)
+
+        while self._history_bytes > budget and self._cursor > 0:
+            self._untrack_state(self._states.popleft())
+            self._cursor -= 1
 
     def _traverse(self, n=1):
         """Traverse state history. Used by `back` and `forward` methods.
@@ -283,6 +667,8 @@ class RoboBrowser(object):
         if cursor >= len(self._states) or cursor < 0:
             raise exceptions.RoboError('Index out of range')
         self._cursor = cursor
+        self._spill_history()
+        self._reduce_history()
 
     def back(self, n=1):
         """Go back in browser history.
@@ -320,6 +706,9 @@ class RoboBrowser(object):
         :return: List of BeautifulSoup tags
 
         """
+        if text is None and not args and not kwargs:
+            return list(self.state.artifact(
+                'links', lambda: helpers.find_all(self.parsed, _link_ptn)))
         return helpers.find_all(
             self.parsed, _link_ptn, text=text, *args, **kwargs
         )
@@ -336,7 +725,17 @@ class RoboBrowser(object):
             kwargs['id'] = id
         form = self.find(_form_ptn, *args, **kwargs)
         if form is not None:
-            return Form(form)
+            return self._build_form(form)
+
+    def _build_form(self, form):
+        """Build a `Form` from a form element. Fields write their values
+        to the element, so with an artifact cache, where pages share parsed
+        trees, each form gets a copy of its element.
+
+        """
+        if self.artifact_cache is not None:
+            form = copy.copy(form)
+        return Form(form)
 
     def get_forms(self, *args, **kwargs):
         """Find forms by standard BeautifulSoup arguments.
@@ -346,61 +745,159 @@ class RoboBrowser(object):
         :return: List of BeautifulSoup tags
 
         """
-        forms = self.find_all(_form_ptn, *args, **kwargs)
+        if not args and not kwargs:
+            forms = self.state.artifact(
+                'forms', lambda: self.find_all(_form_ptn))
+        else:
+            forms = self.find_all(_form_ptn, *args, **kwargs)
         return [
-            Form(form)
+            self._build_form(form)
             for form in forms
         ]
 
-    def follow_link(self, link, **kwargs):
-        """Click a link.
+    def _build_link_url(self, link):
+        """Build absolute URL from the "href" attribute of a link.
 
-        :param Tag link: Link to click
-        :param kwargs: Keyword arguments to `Session::send`
+        :param Tag link: Link element
+        :return: Full URL
 
         """
         try:
             href = link['href']
         except KeyError:
             raise exceptions.RoboError('Link element must have "href" attribute')
-            
-        self.open(self._build_url(href), **kwargs)
+        return self._resolve_url(href)
 
-    def submit_form(self, form, submit=None, **kwargs):
-        """Submit a form.
+    def _build_download_url(self, link):
+        """Build absolute URL from a link element or a URL string.
+
+        :param link: Link element, or full or partial URL
+        :return: Full URL
+
+        """
+        if isinstance(link, string_types):
+            return self._resolve_url(link)
+        return self._build_link_url(link)
+
+    def _build_form_request(self, form, submit=None, **kwargs):
+        """Build the HTTP verb, URL and send arguments for submitting a form.
 
         :param Form form: Filled-out form object
-        :param Submit submit: Optional `Submit` to click, if form includes
-            multiple submits
+        :param Submit submit: Optional `Submit` to click
         :param kwargs: Keyword arguments to `Session::send`
+        :return: Tuple of (method, url, send_args)
 
         """
         # Get HTTP verb
         method = form.method.upper()
 
-        # Send request
         url = self._build_url(form.action) or self.url
         serialized = form.get_payload(submit=submit)
         #serialized = payload.to_requests(method)
         send_args = self._build_send_args(**kwargs)
         send_args.update(serialized)
+        return method, url, send_args
+
+    def follow_link(self, link, **kwargs):
+        """Click a link.
+
+        :param Tag link: Link to click
+        :param kwargs: Keyword arguments to `Session::send`
+
+        """
+        self.open(self._build_link_url(link), **kwargs)
+
+    def follow_links(self, links, max_workers=10, **kwargs):
+        """Click several links concurrently, without changing history or the
+        current page.
+
+        :param list links: Links to click
+        :param int max_workers: Maximum number of concurrent requests
+        :param kwargs: Keyword arguments to `Session::send`
+        :return: List of `RoboState`, in the order of `links`
+
+        """
+        urls = [self._build_link_url(link) for link in links]
+        return self._open_detached(urls, max_workers=max_workers, **kwargs)
+
+    def submit_form(self, form, submit=None, **kwargs):
+        """Submit a form.
+
+        :param Form form: Filled-out form object
+        :param Submit submit: Optional `Submit` to click, if form includes
+            multiple submits
+        :param kwargs: Keyword arguments to `Session::send`
+
+        """
+        # Send request
+        method, url, send_args = self._build_form_request(
+            form, submit=submit, **kwargs)
         response = self.session.request(method, url, **send_args)
 
         # Update history
         self._update_state(response)
         
-    def download(self,link,save_path):
+    def download(self, link, save_path, chunk_size=DEFAULT_CHUNK_SIZE,
+                 resume=False, callback=None, checksum='sha256', segments=1,
+                 **kwargs):
         """
-        Download a file to disk
-        """        
-        try:
-            href = link['href']
-        except KeyError:
-            raise exceptions.RoboError('Link element must have "href" attribute')
-        
-        url = self._build_url(href)
-        
-        request = self.session.get(url, stream=True)
-        
-        with open(save_path, "wb") as file:
-            file.write(request.content)
\ No newline at end of file
+        Download a file to disk, streaming it in chunks so memory use stays
+        bounded. See `download.stream_download` for resume semantics.
+
+        With `segments` above one, the file is split into that many byte
+        ranges fetched concurrently on the browser's session, falling back to
+        a single stream when the server does not support ranges; see
+        `download.segmented_download`. Segmented downloads always start
+        from scratch and ignore `resume`.
+
+        :param link: Link element, or full or partial URL
+        :param str save_path: Destination path
+        :param int chunk_size: Bytes read per chunk
+        :param bool resume: Continue a partial file at `save_path`
+        :param callback: Optional progress callable, called with the
+            in-progress `DownloadResult` after every chunk
+        :param str checksum: Name of a `hashlib` algorithm
+        :param int segments: Number of concurrent range requests
+        :param kwargs: Keyword arguments to `Session::get`
+        :return: DownloadResult with size, elapsed time and checksum
+
+        """
+        url = self._build_download_url(link)
+        send_args = {'timeout': self.timeout}
+        send_args.update(kwargs)
+        if segments > 1:
+            return segmented_download(
+                self.session, url, save_path, segments=segments,
+                chunk_size=chunk_size, callback=callback, checksum=checksum,
+                **send_args)
+        return stream_download(
+            self.session, url, save_path, chunk_size=chunk_size,
+            resume=resume, callback=callback, checksum=checksum, **send_args)
+
+    def download_all(self, links, directory, max_workers=4,
+                     chunk_size=DEFAULT_CHUNK_SIZE, checksum='sha256',
+                     callback=None, **kwargs):
+        """
+        Download many files into a directory concurrently. Links are
+        resolved against the current page and deduplicated; files already
+        present with a matching ETag or size are skipped, and new files are
+        written atomically. See `download.download_all`.
+
+        :param list links: Link elements, or full or partial URLs
+        :param str directory: Destination directory
+        :param int max_workers: Maximum number of concurrent downloads
+        :param int chunk_size: Bytes read per chunk
+        :param str checksum: Name of a `hashlib` algorithm
+        :param callback: Optional callable, called with each
+            `DownloadResult` as its file finishes
+        :param kwargs: Keyword arguments to `Session::get`
+        :return: List of `DownloadResult` with bytes, timings and errors
+
+        """
+        urls = [self._build_download_url(link) for link in links]
+        send_args = {'timeout': self.timeout}
+        send_args.update(kwargs)
+        return download_all(
+            self.session, urls, directory, max_workers=max_workers,
+            chunk_size=chunk_size, checksum=checksum, callback=callback,
+            **send_args)
@@ -3,11 +3,24 @@ Caching utilities for robotic browsers. Credit to
 https://github.com/Lukasa/httpcache
 """
 
+import re
+import time
+import heapq
+import fnmatch
 import logging
 import datetime
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_tz, mktime_tz
 from requests.adapters import HTTPAdapter
 
-from robobrowser.compat import OrderedDict, iteritems
+from robobrowser.compat import (
+    urlparse, unquote, string_types, OrderedDict, cpu_time,
+)
+from robobrowser.backends import MemoryStorage
+from robobrowser.store import CODECS, CachedResponse
 
 logger = logging.getLogger(__name__)
 
@@ -16,85 +29,1452 @@ logger = logging.getLogger(__name__)
 CACHE_VERBS = ['GET']
 CACHE_CODES = [200, 203, 300, 301, 410]
 
+# Error codes whose `Retry-After` header sets the negative caching TTL
+RETRY_AFTER_CODES = [429, 503]
+
+_MISSING = object()
+
+# Most URLs whose `Vary` names are remembered from a shared storage
+_VARY_HINTS = 1024
+
+
+def parse_cache_control(value):
+    """Parse a `Cache-Control` header into a dict of lower-cased directives.
+    Directives without an argument map to `True`.
+
+    :param str value: Header value
+    :return: dict
+
+    """
+    directives = {}
+    for part in (value or '').split(','):
+        name, sep, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip().strip('"') if sep else True
+    return directives
+
+
+def _parse_seconds(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_date(value):
+    """Parse an HTTP date into a UNIX timestamp, or None if invalid."""
+    parsed = parsedate_tz(value) if value else None
+    return mktime_tz(parsed) if parsed else None
+
+
+def retry_after(response):
+    """Delay requested by a `Retry-After` header, in seconds; either a
+    number of seconds or an HTTP date.
+
+    :param requests.Response response: HTTP response
+    :return: Delay in seconds, or None if the header is missing or invalid
+
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    seconds = _parse_seconds(value)
+    if seconds is not None:
+        return seconds
+    date = _parse_date(value)
+    if date is None:
+        return None
+    now = _parse_date(response.headers.get('Date')) or time.time()
+    return max(date - now, 0)
+
+
+def freshness_lifetime(response):
+    """Freshness lifetime of a response, in seconds, from its headers. The
+    cache may serve many browsers at once, so it behaves as a shared cache:
+    `s-maxage` takes precedence over `max-age`, which takes precedence over
+    `Expires`. The response's current `Age` is subtracted.
+
+    :param requests.Response response: HTTP response
+    :return: Lifetime in seconds, or None if the headers don't say
+
+    """
+    headers = response.headers
+    directives = parse_cache_control(headers.get('Cache-Control'))
+    lifetime = None
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            lifetime = _parse_seconds(directives[name])
+            if lifetime is not None:
+                break
+    if lifetime is None and 'Expires' in headers:
+        expires = _parse_date(headers['Expires'])
+        date = _parse_date(headers.get('Date')) or time.time()
+        # An invalid `Expires` means already expired
+        lifetime = max(expires - date, 0) if expires is not None else 0
+    if lifetime is None:
+        return None
+    age = _parse_seconds(headers.get('Age')) or 0
+    return max(lifetime - age, 0)
+
+
+def conditional_headers(response):
+    """Request headers to revalidate a stored response with its origin:
+    `If-None-Match` from its `ETag` and `If-Modified-Since` from its
+    `Last-Modified`. Empty if the response has neither validator.
+
+    :param requests.Response response: Stored response
+    :return: dict
+
+    """
+    headers = {}
+    if response.headers.get('ETag'):
+        headers['If-None-Match'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        headers['If-Modified-Since'] = response.headers['Last-Modified']
+    return headers
+
+
+# Headers describing the body of a `304`'s stored response, which the `304`
+# itself must not overwrite
+_BODY_HEADERS = ('content-length', 'content-encoding', 'transfer-encoding')
+
+
+def _variant_key(url, names, headers):
+    """Cache key for a response that varies on request headers `names`."""
+    if not names:
+        return url
+    return url + '\n' + '\n'.join(
+        '{0}={1}'.format(name, headers.get(name, ''))
+        for name in names
+    )
+
+
+def _vary_names(response):
+    """Sorted request header names a response varies on, or None if it
+    varies on everything (`Vary: *`).
+
+    """
+    vary = [
+        name.strip().lower()
+        for name in response.headers.get('Vary', '').split(',')
+        if name.strip()
+    ]
+    if '*' in vary:
+        return None
+    return sorted(set(vary))
+
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class KeyNormalizer(object):
+    """
+    Map URLs to cache keys, so that equivalent URLs share an entry.
+
+    :param bool sort_query: Sort query parameters, so their order is ignored
+    :param list drop_params: Names of query parameters to drop, such as
+        tracking or session parameters; shell-style wildcards are allowed
+    :param bool lowercase: Lower-case the scheme and host
+    :param bool strip_default_port: Drop `:80` from http and `:443` from
+        https URLs
+    :param key_func: Optional function applied to the normalized URL to
+        produce the final key
+
+    """
+    def __init__(self, sort_query=True, drop_params=('utm_*', ),
+                 lowercase=True, strip_default_port=True, key_func=None):
+        self.sort_query = sort_query
+        self.drop_params = list(drop_params or ())
+        self.lowercase = lowercase
+        self.strip_default_port = strip_default_port
+        self.key_func = key_func
+
+    def __repr__(self):
+        return '<KeyNormalizer drop_params={0!r}>'.format(self.drop_params)
+
+    def _dropped(self, param):
+        name = unquote(param.partition('=')[0])
+        return any(
+            fnmatch.fnmatchcase(name, pattern) for pattern in self.drop_params
+        )
+
+    def __call__(self, url):
+        parsed = urlparse.urlsplit(url)
+        scheme, netloc = parsed.scheme, parsed.netloc
+        if self.lowercase:
+            scheme = scheme.lower()
+            # Keep the case of any credentials
+            userinfo, at, host = netloc.rpartition('@')
+            netloc = userinfo + at + host.lower()
+        if self.strip_default_port and parsed.port is not None and \
+                parsed.port == _DEFAULT_PORTS.get(scheme):
+            netloc = netloc.rpartition(':')[0]
+        params = [param for param in parsed.query.split('&') if param]
+        if self.drop_params:
+            params = [param for param in params if not self._dropped(param)]
+        if self.sort_query:
+            params.sort()
+        url = urlparse.urlunsplit((
+            scheme, netloc, parsed.path, '&'.join(params), parsed.fragment))
+        if self.key_func is not None:
+            url = self.key_func(url)
+        return url
+
+
+def _synchronized(method):
+    """Run a `RoboCache` method under the cache's lock."""
+    @functools.wraps(method)
+    def wrapped(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapped
+
+
+class CacheStats(object):
+    """Counters describing a `RoboCache`.
+
+    :ivar int hits: Lookups answered with a fresh entry
+    :ivar int misses: Lookups without a fresh entry
+    :ivar int stores: Responses stored
+    :ivar dict evictions: Number of entries evicted, by reason
+    :ivar int normalized_hits: Hits whose URL differed from the stored
+        response's, found only through key normalization
+    :ivar int compressed: Number of bodies compressed on store
+    :ivar int raw_bytes: Size of those bodies before compression
+    :ivar int packed_bytes: Size of those bodies after compression
+    :ivar float compress_time: CPU seconds spent compressing
+    :ivar float decompress_time: CPU seconds spent decompressing on read
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = {}
+        self.normalized_hits = 0
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.packed_bytes = 0
+        self.compress_time = 0.0
+        self.decompress_time = 0.0
+
+    def __repr__(self):
+        return '<CacheStats hits={0} misses={1}>'.format(
+            self.hits, self.misses)
+
+    @property
+    def hit_ratio(self):
+        """Fraction of lookups that were hits; 0 if none."""
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+    def record_eviction(self, reason, count=1):
+        with self._lock:
+            self.evictions[reason] = self.evictions.get(reason, 0) + count
+
+    @property
+    def compression_ratio(self):
+        """Raw over compressed size of stored bodies; 1 if none."""
+        if not self.packed_bytes:
+            return 1.0
+        return self.raw_bytes / float(self.packed_bytes)
+
+    def record_compress(self, raw_bytes, packed_bytes, elapsed):
+        with self._lock:
+            self.compressed += 1
+            self.raw_bytes += raw_bytes
+            self.packed_bytes += packed_bytes
+            self.compress_time += elapsed
+
+    def record_decompress(self, elapsed):
+        with self._lock:
+            self.decompress_time += elapsed
+
+
+def _request_method(response):
+    """Method of the request that produced a response; GET if unknown."""
+    request = getattr(response, 'request', None)
+    return getattr(request, 'method', None) or 'GET'
+
+
+def _response_size(response):
+    """Size of a response body, in bytes; zero if it can't be read."""
+    if isinstance(response, CachedResponse) and response._content is False:
+        return len(response.packed)
+    content = getattr(response, 'content', None)
+    if isinstance(content, bytes):
+        return len(content)
+    return 0
+
+
 class RoboCache(object):
+    """Cache of responses keyed by URL. Entries are evicted in least
+    recently used order when a count or size limit is exceeded. Safe to
+    share between threads.
 
-    def __init__(self, max_age=None, max_count=None):
-        self.data = OrderedDict()
+    :param timedelta max_age: Max age of entries. In header-aware mode,
+        entries with validators are kept past it for revalidation, bounded
+        by `max_count` and `max_bytes`, except in a shared storage
+    :param int max_count: Max number of entries
+    :param int max_bytes: Max total size of cached bodies, in bytes
+    :param int max_entry_bytes: Max size of a single cached body; defaults
+        to `max_bytes`. Larger responses are not cached
+    :param BaseStorage storage: Storage backend; defaults to an in-memory
+        `MemoryStorage`. Use `SQLiteStorage` for a cache that survives
+        restarts, with `shared=True` to share it between processes
+    :param bool respect_headers: Follow HTTP caching headers: only cache
+        responses with an explicit freshness lifetime from `Cache-Control`
+        or `Expires`, or with an `ETag` or `Last-Modified` validator; serve
+        them until they go stale, and keep stale entries with validators
+        for revalidation. Skip `no-store` and `private` responses, and key
+        entries on the request headers named by `Vary`
+    :param timedelta stale_while_revalidate: How long past expiry an entry
+        may still be served while it is refreshed in the background. In
+        header-aware mode, a longer `stale-while-revalidate` directive on
+        the response takes precedence
+    :param str compression: Compress stored bodies with this codec,
+        `'zlib'` or `'lzma'`. Size limits apply to compressed sizes, and
+        hits are decompressed only when their content is read
+    :param KeyNormalizer normalize: Map URLs to cache keys; pass `True`
+        for a `KeyNormalizer` with default settings, or any function from
+        URL to key. By default URLs are used as-is
+    :param list codes: Cacheable status codes; defaults to `CACHE_CODES`
+    :param list verbs: Cacheable request methods; defaults to `CACHE_VERBS`
+    :param dict negative_ttls: Cache error responses for a short time,
+        mapping status codes (e.g. `404`) or classes (`'4xx'`, `'5xx'`) to
+        timedeltas; codes take precedence over classes. A `Retry-After`
+        header on a 429 or 503 response sets its TTL instead. Negative
+        entries are never served stale or revalidated, and `max_age`
+        still bounds their age. In header-aware mode, `no-store`,
+        `private` and `Vary` apply to them as to other responses
+    :param on_evict: Function called as `on_evict(key, entry, reason)` when
+        an entry is evicted to satisfy `max_count` (reason `'count'`),
+        `max_bytes` (`'bytes'`) or `max_age` (`'age'`), or dropped on
+        lookup once stale (`'expired'`); called with the cache locked.
+        Entries evicted by a shared storage (`'shared'`) are only counted
+        in `stats`
+    :param on_store: Function called as `on_store(key, entry)` after a
+        response is stored; called with the cache locked
+
+    """
+    def __init__(self, max_age=None, max_count=None, max_bytes=None,
+                 max_entry_bytes=None, storage=None, respect_headers=False,
+                 stale_while_revalidate=None, compression=None,
+                 normalize=None, codes=None, verbs=None, negative_ttls=None,
+                 on_evict=None, on_store=None):
+        if compression is not None and compression not in CODECS:
+            raise ValueError(
+                'Unsupported compression {0!r}; choose from {1}'.format(
+                    compression, ', '.join(sorted(CODECS))))
+        self.data = storage if storage is not None else MemoryStorage()
         self.max_age = max_age
         self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes
+        self.respect_headers = respect_headers
+        self.stale_while_revalidate = stale_while_revalidate
+        self.compression = compression
+        self.normalize = KeyNormalizer() if normalize is True else normalize
+        self.codes = set(codes or CACHE_CODES)
+        self.verbs = set(verbs or CACHE_VERBS)
+        self.negative_ttls = negative_ttls or {}
+        self.on_evict = on_evict
+        self.on_store = on_store
+        self.stats = CacheStats()
+
+        # Guards storage and index; adapters may be shared between threads
+        self._lock = threading.RLock()
+
+        # Request headers each URL varies on, as of its latest response
+        self._vary = {}
+
+        # Index of storage dates and body sizes, and a heap of
+        # (date, seq, key) ordering entries for expiry; empty for shared
+        # storages. Heap items for replaced or evicted entries are skipped
+        # when popped, and compacted once they dominate the heap. Entries
+        # with validators are left out of the heap, so age doesn't evict
+        # them
+        self._dates = {}
+        self._sizes = {}
+        self._validated = set()
+        self._bytes = 0
+        self._expiry = []
+        self._counter = itertools.count()
+        # Stored variants per URL, so `_vary` is pruned with its entries.
+        # A shared storage is read for `Vary` on misses instead, and
+        # `_vary` only caches what was read
+        self._vary_keys = {}
+        self._vary_counts = {}
+        if not self.data.shared:
+            for key, entry in self.data.iter_meta():
+                self._index(key, entry['date'], entry.get('size', 0),
+                            entry.get('validators', False))
+                self._track_vary(key, entry)
+
+    def _index(self, key, date, size=0, validators=False):
+        """Add an entry to the index.
+
+        :param key: Cache key
+        :param datetime.datetime date: Storage date
+        :param int size: Body size, in bytes
+        :param bool validators: Entry can be revalidated, so isn't evicted
+            by age
+
+        """
+        self._bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self._dates[key] = date
+        if validators:
+            self._validated.add(key)
+            return
+        self._validated.discard(key)
+        heapq.heappush(self._expiry, (date, next(self._counter), key))
+        if len(self._expiry) > 2 * len(self._dates) + 64:
+            self._expiry = [
+                (date, next(self._counter), key)
+                for key, date in self._dates.items()
+                if key not in self._validated
+            ]
+            heapq.heapify(self._expiry)
+
+    def _unindex(self, key):
+        """Remove an entry from the index.
+
+        :param key: Cache key
+
+        """
+        self._dates.pop(key, None)
+        self._bytes -= self._sizes.pop(key, 0)
+        self._validated.discard(key)
+        self._untrack_vary(key)
+
+    def _track_vary(self, key, entry):
+        """Record the `Vary` names of a stored entry for its URL.
+
+        :param key: Cache key
+        :param dict entry: Cache entry
+
+        """
+        if entry.get('vary') is None:
+            return
+        url_key = self._url_key(entry['url'], entry.get('method'))
+        if self.data.shared:
+            if len(self._vary) >= _VARY_HINTS:
+                self._vary.clear()
+            self._vary[url_key] = entry['vary']
+            return
+        if self._vary_keys.get(key) != url_key:
+            self._untrack_vary(key)
+            self._vary_keys[key] = url_key
+            self._vary_counts[url_key] = self._vary_counts.get(url_key, 0) + 1
+        self._vary[url_key] = entry['vary']
+
+    def _untrack_vary(self, key):
+        """Forget a stored entry, dropping the `Vary` names of its URL
+        with its last entry.
+
+        :param key: Cache key
+
+        """
+        url_key = self._vary_keys.pop(key, None)
+        if url_key is None:
+            return
+        self._vary_counts[url_key] -= 1
+        if not self._vary_counts[url_key]:
+            del self._vary_counts[url_key]
+            self._vary.pop(url_key, None)
+
+    def _shared_vary(self, url_key):
+        """Read the `Vary` names of a URL from a shared storage, where
+        another process may have stored it.
+
+        :param url_key: Cache key of the URL, before `Vary` handling
+        :return: List of names, or None if no entry is stored
+
+        """
+        for key, entry in self.data.iter_prefix(url_key):
+            if key == url_key or key.startswith(url_key + '\n'):
+                return entry.get('vary')
+        return None
+
+    def _remove(self, key, reason=None):
+        """Remove an entry from storage and the index.
+
+        :param key: Cache key
+        :param str reason: Why the entry is evicted, if it is
+
+        """
+        # Another process may have removed a shared entry already
+        entry = self.data.pop(key, None)
+        self._unindex(key)
+        if reason is not None and entry is not None:
+            self._evicted(key, entry, reason)
+
+    def _evicted(self, key, entry, reason):
+        self.stats.record_eviction(reason)
+        if self.on_evict is not None:
+            self.on_evict(key, entry, reason)
 
     def _reduce_age(self, now):
-        """Reduce size of cache by date.
+        """Reduce size of cache by date. Pops expired entries off the expiry
+        heap, so the cost is O(log n) per expired entry rather than a scan
+        of the whole cache.
 
         :param datetime.datetime now: Current time
 
         """
-        if self.max_age:
-            keys = [
-                key for key, value in iteritems(self.data)
-                if now - value['date'] > self.max_age
-            ]
-            for key in keys:
-                del self.data[key]
+        if not self.max_age:
+            return
+        # Keep entries that may still be served stale
+        max_age = self.max_age + (
+            self.stale_while_revalidate or datetime.timedelta(0))
+        while self._expiry:
+            date, _, key = self._expiry[0]
+            if now - date <= max_age:
+                break
+            heapq.heappop(self._expiry)
+            if self._dates.get(key) == date and \
+                    key not in self._validated:
+                self._remove(key, 'age')
+
+    def _evict(self, reason):
+        """Evict the least recently used entry.
+
+        :param str reason: Limit that required the eviction
+
+        """
+        key, entry = self.data.popitem(last=False)
+        self._unindex(key)
+        self._evicted(key, entry, reason)
 
     def _reduce_count(self):
         """Reduce size of cache by count.
 
         """
         if self.max_count:
-            while len(self.data) > self.max_count:
-                self.data.popitem(last=False)
+            while len(self._dates) > self.max_count:
+                self._evict('count')
+
+    def _reduce_bytes(self):
+        """Reduce size of cache by total body size.
+
+        """
+        if self.max_bytes:
+            while self._bytes > self.max_bytes and self._dates:
+                self._evict('bytes')
+
+    def _reduce_shared(self, now):
+        """Reduce size of a shared cache. Other processes write to the same
+        storage, so the local index is incomplete; the storage enforces
+        limits over all entries instead.
+
+        :param datetime.datetime now: Current time
+
+        """
+        min_date = None
+        if self.max_age:
+            min_date = now - self.max_age - (
+                self.stale_while_revalidate or datetime.timedelta(0))
+        if not (min_date or self.max_count or self.max_bytes):
+            return
+        evicted = self.data.enforce(
+            max_count=self.max_count, max_bytes=self.max_bytes,
+            min_date=min_date)
+        for key in evicted:
+            self._unindex(key)
+        if evicted:
+            self.stats.record_eviction('shared', len(evicted))
+
+    def _storage_key(self, response, negative_ttl=None):
+        """Choose the storage key and expiry time for a response, following
+        its caching headers.
+
+        :param requests.Response response: HTTP response
+        :param timedelta negative_ttl: TTL of an error response, which
+            replaces its freshness lifetime
+        :return: Tuple of (key, expiry datetime), or None if the response
+            must not be cached
+
+        """
+        directives = parse_cache_control(response.headers.get('Cache-Control'))
+        if 'no-store' in directives or 'private' in directives:
+            return None
+        request = getattr(response, 'request', None)
+        request_headers = request.headers if request is not None else {}
+        if 'no-store' in parse_cache_control(
+                request_headers.get('Cache-Control')):
+            return None
+        vary = _vary_names(response)
+        if vary is None:
+            return None
+        if negative_ttl is not None:
+            expires = datetime.datetime.now() + negative_ttl
+        else:
+            lifetime = freshness_lifetime(response) or 0
+            if 'no-cache' in directives:
+                lifetime = 0
+            if not lifetime and not conditional_headers(response):
+                return None
+            expires = self._expires(lifetime)
+        url_key = self._url_key(response.url, _request_method(response))
+        key = _variant_key(url_key, vary, request_headers)
+        return key, expires
+
+    def _url_key(self, url, method=None):
+        """Cache key for a URL, before `Vary` handling. Methods other than
+        GET get keys of their own.
+
+        """
+        if self.normalize is not None:
+            url = self.normalize(url)
+        if method and method != 'GET':
+            url = '{0} {1}'.format(method, url)
+        return url
+
+    def _expires(self, lifetime):
+        return datetime.datetime.now() + datetime.timedelta(seconds=lifetime)
+
+    def _negative_ttl(self, response):
+        """How long to cache an error response, or None to skip it."""
+        code = response.status_code
+        ttl = self.negative_ttls.get(code)
+        if ttl is None:
+            ttl = self.negative_ttls.get('{0}xx'.format(code // 100))
+        if ttl is None:
+            return None
+        if code in RETRY_AFTER_CODES:
+            seconds = retry_after(response)
+            if seconds is not None:
+                ttl = datetime.timedelta(seconds=seconds)
+        return ttl if ttl > datetime.timedelta(0) else None
+
+    def _expires_at(self, entry):
+        """Time an entry goes stale, or None if it never does."""
+        if self.respect_headers or entry.get('negative'):
+            return entry.get('expires')
+        if self.max_age:
+            return entry['date'] + self.max_age
+        return None
+
+    def _stale_window(self, entry):
+        """How long past expiry an entry may be served stale."""
+        if entry.get('negative'):
+            return datetime.timedelta(0)
+        window = self.stale_while_revalidate or datetime.timedelta(0)
+        if self.respect_headers:
+            directives = parse_cache_control(
+                entry['response'].headers.get('Cache-Control'))
+            seconds = _parse_seconds(directives.get('stale-while-revalidate'))
+            if seconds:
+                window = max(window, datetime.timedelta(seconds=seconds))
+        return window
+
+    def _pack(self, response):
+        """Compress a response for storage, if compression is on."""
+        if not self.compression or isinstance(response, CachedResponse):
+            return response
+        start = cpu_time()
+        packed = CachedResponse.pack(response, self.compression)
+        self.stats.record_compress(
+            len(response.content or b''), len(packed.packed),
+            cpu_time() - start)
+        return packed
+
+    def _unpack(self, response):
+        """Private copy of a stored response for a reader."""
+        if isinstance(response, CachedResponse):
+            return response.unpacked(self.stats)
+        return response
 
     def store(self, response):
-        """Store response in cache, skipping if code is forbidden.
+        """Store response in cache, skipping if code or verb is forbidden.
+        Error responses are stored per `negative_ttls`.
 
         :param requests.Response response: HTTP response
 
         """
-        if response.status_code not in CACHE_CODES:
+        negative_ttl = None
+        if response.status_code not in self.codes:
+            negative_ttl = self._negative_ttl(response)
+            if negative_ttl is None:
+                return
+        if _request_method(response) not in self.verbs:
             return
-        now = datetime.datetime.now()
-        self.data[response.url] = {
-            'date': now,
+        keyed = self._store_key(response, negative_ttl)
+        if keyed is None:
+            return
+        # Compress outside the lock, and only responses that may be cached
+        key, expires = keyed
+        self._store(self._pack(response), key, expires, negative_ttl)
+
+    @_synchronized
+    def _store_key(self, response, negative_ttl=None):
+        """Storage key and expiry time for a response, or None if it must
+        not be cached.
+
+        """
+        if self.respect_headers:
+            return self._storage_key(response, negative_ttl)
+        key = self._url_key(response.url, _request_method(response))
+        if negative_ttl is not None:
+            return key, datetime.datetime.now() + negative_ttl
+        return key, None
+
+    @_synchronized
+    def _store(self, response, key, expires, negative_ttl=None):
+        method = _request_method(response)
+        size = _response_size(response)
+        if self.max_entry_bytes and size > self.max_entry_bytes:
+            return
+        entry = {
+            'date': datetime.datetime.now(),
+            'size': size,
             'response': response,
         }
-        logger.info('Stored response in cache')
-        self._reduce_age(now)
-        self._reduce_count()
+        if self.respect_headers:
+            entry.update({
+                'url': response.url,
+                'method': method,
+                'vary': _vary_names(response),
+                'expires': expires,
+            })
+        if negative_ttl is not None:
+            entry.update({
+                'negative': True,
+                'expires': expires,
+            })
+        elif self.respect_headers and conditional_headers(response):
+            entry['validators'] = True
+        self._insert(key, entry)
+        self.stats.stores += 1
+        if self.on_store is not None:
+            self.on_store(key, entry)
+        logger.debug('Stored response in cache')
+
+    def _insert(self, key, entry):
+        """Write an entry, index it and enforce limits."""
+        self.data[key] = entry
+        self.data.touch(key)
+        self._track_vary(key, entry)
+        now = datetime.datetime.now()
+        if self.data.shared:
+            # Other processes evict entries without telling this index, so
+            # a shared storage isn't indexed locally
+            self._reduce_shared(now)
+        else:
+            self._index(key, entry['date'], entry.get('size', 0),
+                        entry.get('validators', False))
+            self._reduce_age(now)
+            self._reduce_count()
+            self._reduce_bytes()
 
-    def retrieve(self, request):
-        """Look up request in cache, skipping if verb is forbidden.
+    @_synchronized
+    def adopt(self, key, entry):
+        """Insert an entry taken from another cache with the same key
+        settings, keeping its dates. Used to move entries between tiers.
 
-        :param requests.Request request: HTTP request
+        :param key: Cache key
+        :param dict entry: Cache entry
 
         """
-        if request.method not in CACHE_VERBS:
-            return
+        self._insert(key, entry)
+
+    def _lookup_key(self, request):
+        """Storage key for a request, or None if the cache can't be used."""
+        url_key = self._url_key(request.url, request.method)
+        if not self.respect_headers:
+            return url_key
+        directives = parse_cache_control(request.headers.get('Cache-Control'))
+        if 'no-cache' in directives or 'no-store' in directives:
+            return None
+        return _variant_key(url_key, self._vary.get(url_key), request.headers)
+
+    def _lookup(self, request):
+        """Find the entry for a request.
+
+        :return: Tuple of (key, entry), or (None, None) on a miss
+
+        """
+        if request.method not in self.verbs:
+            return None, None
+        key = self._lookup_key(request)
+        if key is None:
+            return None, None
         try:
-            response = self.data[request.url]['response']
-            logger.info('Retrieved response from cache')
-            return response
+            return key, self.data[key]
         except KeyError:
+            pass
+        if self.data.shared and self.respect_headers:
+            # The URL may vary differently in another process' entries
+            url_key = self._url_key(request.url, request.method)
+            vary = self._shared_vary(url_key)
+            if vary is not None and vary != self._vary.get(url_key):
+                self._track_vary(key, {
+                    'url': request.url, 'method': request.method,
+                    'vary': vary,
+                })
+                return self._lookup(request)
+        return None, None
+
+    @_synchronized
+    def retrieve_entry(self, request, remove=False, count=True):
+        """Look up the fresh entry for a request, counting a hit or miss.
+
+        :param requests.Request request: HTTP request
+        :param bool remove: Remove the entry from this cache on a hit
+        :param bool count: Count the lookup in `stats`; off for repeated
+            lookups of a request already counted
+        :return: Tuple of (key, entry), or (None, None) on a miss
+
+        """
+        key, entry = self._lookup(request)
+        if entry is not None:
+            expires = self._expires_at(entry)
+            now = datetime.datetime.now()
+            if expires is not None and now >= expires:
+                stale_until = expires + self._stale_window(entry)
+                if now >= stale_until and (
+                        entry.get('negative') or
+                        not conditional_headers(entry['response'])):
+                    self._remove(key, 'expired')
+                entry = None
+        if entry is None:
+            if count:
+                self.stats.misses += 1
+            return None, None
+        if remove:
+            self._remove(key)
+        else:
+            self.data.touch(key)
+        if count:
+            self.stats.hits += 1
+            if self.normalize is not None and \
+                    entry['response'].url != request.url:
+                self.stats.normalized_hits += 1
+        logger.debug('Retrieved response from cache')
+        return key, entry
+
+    def retrieve(self, request, count=True):
+        """Look up request in cache, skipping if verb is forbidden. Stale
+        entries are not returned; those without validators are dropped.
+
+        :param requests.Request request: HTTP request
+        :param bool count: Count the lookup as a hit or miss
+
+        """
+        if request.method not in self.verbs:
+            return None
+        _, entry = self.retrieve_entry(request, count=count)
+        if entry is None:
+            return None
+        return self._unpack(entry['response'])
+
+    @_synchronized
+    def retrieve_stale(self, request):
+        """Look up a stale entry that may still be served while it is
+        refreshed, per `stale_while_revalidate`.
+
+        :param requests.Request request: HTTP request
+        :return: requests.Response, or None
+
+        """
+        key, entry = self._lookup(request)
+        if entry is None:
+            return None
+        expires = self._expires_at(entry)
+        if expires is None:
+            return None
+        now = datetime.datetime.now()
+        if not expires <= now < expires + self._stale_window(entry):
+            return None
+        self.data.touch(key)
+        logger.debug('Retrieved stale response from cache')
+        return self._unpack(entry['response'])
+
+    @_synchronized
+    def validators(self, request):
+        """Conditional request headers for revalidating a stale entry.
+
+        :param requests.Request request: HTTP request
+        :return: dict of headers, or None if there is nothing to revalidate
+
+        """
+        key, entry = self._lookup(request)
+        if entry is None or entry.get('negative'):
+            return None
+        return conditional_headers(entry['response']) or None
+
+    @_synchronized
+    def refresh(self, request, response):
+        """Update a stale entry from a `304 Not Modified` response: merge
+        its headers into the stored response, recompute freshness and
+        return the stored response.
+
+        :param requests.Request request: Conditional request
+        :param requests.Response response: `304` response
+        :return: Stored requests.Response, or None if the entry is gone
+
+        """
+        key, entry = self._lookup(request)
+        if entry is None:
+            return None
+        stored = entry['response']
+        for name, value in response.headers.items():
+            if name.lower() not in _BODY_HEADERS:
+                stored.headers[name] = value
+        now = datetime.datetime.now()
+        entry['date'] = now
+        if self.respect_headers:
+            entry['expires'] = self._expires(freshness_lifetime(stored) or 0)
+        self.data[key] = entry
+        self.data.touch(key)
+        if not self.data.shared:
+            self._index(key, now, entry.get('size', 0),
+                        entry.get('validators', False))
+        logger.debug('Revalidated response in cache')
+        return self._unpack(stored)
+
+    def _index_items(self):
+        """(key, date, size) of every entry. A shared storage is read
+        directly, as the local index misses other processes' entries.
+
+        """
+        if self.data.shared:
+            return [
+                (key, entry['date'], entry.get('size', 0))
+                for key, entry in self.data.iter_meta()
+            ]
+        return [
+            (key, date, self._sizes.get(key, 0))
+            for key, date in self._dates.items()
+        ]
+
+    @_synchronized
+    def summary(self):
+        """Snapshot of the cache's counters and contents, e.g. for sizing
+        `max_count` and `max_age`.
+
+        :return: dict with `hits`, `misses`, `hit_ratio`, `stores`,
+            `evictions` by reason, resident `count` and `bytes`, and the
+            `average_age` of entries in seconds
+
+        """
+        items = self._index_items()
+        now = datetime.datetime.now()
+        ages = [(now - date).total_seconds() for _, date, _ in items]
+        return {
+            'hits': self.stats.hits,
+            'misses': self.stats.misses,
+            'hit_ratio': self.stats.hit_ratio,
+            'stores': self.stats.stores,
+            'evictions': dict(self.stats.evictions),
+            'count': len(items),
+            'bytes': sum(size for _, _, size in items),
+            'average_age': sum(ages) / len(ages) if ages else 0.0,
+        }
+
+    @_synchronized
+    def keys_by(self, order='age', limit=None):
+        """List entries, oldest or largest first.
+
+        :param str order: `'age'` or `'size'`
+        :param int limit: Max number of entries to list
+        :return: List of (key, size in bytes, age in seconds) tuples
+
+        """
+        if order not in ('age', 'size'):
+            raise ValueError(
+                'Unsupported order {0!r}; choose from age, size'.format(order))
+        now = datetime.datetime.now()
+        listed = [
+            (key, size, (now - date).total_seconds())
+            for key, date, size in self._index_items()
+        ]
+        listed.sort(key=lambda item: item[2 if order == 'age' else 1],
+                    reverse=True)
+        return listed[:limit] if limit is not None else listed
+
+    @_synchronized
+    def clear(self):
+        "Clear cache."
+        self.data.clear()
+        self._vary.clear()
+        self._vary_keys.clear()
+        self._vary_counts.clear()
+        self._dates.clear()
+        self._sizes.clear()
+        self._validated.clear()
+        self._bytes = 0
+        self._expiry = []
+
+class TieredCache(object):
+    """
+    Two-level cache: a small in-memory `RoboCache` (L1) of live responses
+    in front of a large persistent one (L2). New responses go to L1;
+    entries evicted from L1 by its count or size limit are demoted to L2,
+    replacing any older copy, and L2 hits are copied back to L1. L2 keeps
+    promoted entries, so a persistent or shared L2 still holds them if
+    the process exits before they are demoted again. Each tier counts its
+    own hits and misses in its `stats`.
+
+    Both tiers must use the same key settings (`respect_headers` and
+    `normalize`). L1's `on_evict` is taken over for demotion; entries it
+    drops for age are not demoted.
+
+    :param RoboCache l1: Memory tier; defaults to 100 entries
+    :param RoboCache l2: Persistent tier, e.g. backed by `SQLiteStorage`
+
+    """
+    def __init__(self, l1=None, l2=None):
+        self.l1 = l1 if l1 is not None else RoboCache(max_count=100)
+        self.l2 = l2 if l2 is not None else RoboCache()
+        self.l1.on_evict = self._demote
+
+    def __repr__(self):
+        return '<TieredCache l1={0} l2={1}>'.format(
+            len(self.l1.data), len(self.l2.data))
+
+    @property
+    def verbs(self):
+        return self.l1.verbs
+
+    def _demote(self, key, entry, reason):
+        if reason in ('count', 'bytes', 'flush'):
+            self.l2.adopt(key, entry)
+
+    def _lookup_key(self, request):
+        return self.l1._lookup_key(request)
+
+    def store(self, response):
+        self.l1.store(response)
+
+    def retrieve(self, request, count=True):
+        """Look up request in L1, then in L2, copying L2 hits to L1.
+
+        :param requests.Request request: HTTP request
+        :param bool count: Count the lookup as a hit or miss
+
+        """
+        if request.method not in self.verbs:
             return None
+        _, entry = self.l1.retrieve_entry(request, count=count)
+        if entry is None:
+            key, entry = self.l2.retrieve_entry(request, count=count)
+            if entry is None:
+                return None
+            entry = dict(entry)
+            self.l1.adopt(key, entry)
+        return self.l1._unpack(entry['response'])
+
+    def retrieve_stale(self, request):
+        return (
+            self.l1.retrieve_stale(request) or
+            self.l2.retrieve_stale(request))
+
+    def validators(self, request):
+        return self.l1.validators(request) or self.l2.validators(request)
+
+    def refresh(self, request, response):
+        return (
+            self.l1.refresh(request, response) or
+            self.l2.refresh(request, response))
+
+    def flush(self):
+        """Demote every L1 entry to L2, e.g. before exit."""
+        with self.l1._lock:
+            while len(self.l1._dates):
+                self.l1._evict('flush')
+
+    def clear(self):
+        "Clear both tiers."
+        self.l1.clear()
+        self.l2.clear()
+
+    def close(self):
+        """Flush L1 and close L2's storage."""
+        self.flush()
+        self.l2.data.close()
+
+
+class ArtifactCache(object):
+    """
+    LRU cache of artifacts derived from response bodies, such as parsed
+    trees and the link and form elements found in them. Artifacts are
+    keyed by body hash, parser name, encoding and kind, so pages with
+    identical bodies share them, whether or not their responses came from a
+    `RoboCache`. Shared artifacts must be treated as read-only.
+
+    :param int max_count: Max number of artifacts kept
+
+    """
+    def __init__(self, max_count=64):
+        self.max_count = max_count
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return '<ArtifactCache artifacts={0} hits={1} misses={2}>'.format(
+            len(self._data), self.hits, self.misses)
+
+    def get(self, digest, parser, kind, build, encoding=None):
+        """Return a cached artifact, building and caching it on a miss.
+        Builds run outside the lock, so a slow parse doesn't block lookups.
+
+        :param str digest: Body hash, from `backends.body_digest`
+        :param str parser: Parser name
+        :param str kind: Artifact kind, e.g. `'parsed'`
+        :param build: Function returning the artifact
+        :param str encoding: Encoding the body is decoded with; bodies
+            decoded differently don't share artifacts
+        :return: Artifact
+
+        """
+        key = (digest, parser, encoding, kind)
+        with self._lock:
+            if key in self._data:
+                artifact = self._data.pop(key)
+                self._data[key] = artifact
+                self.hits += 1
+                return artifact
+            self.misses += 1
+        artifact = build()
+        with self._lock:
+            self._data[key] = artifact
+            while len(self._data) > self.max_count:
+                self._data.popitem(last=False)
+        return artifact
 
     def clear(self):
         "Clear cache."
-        self.data = OrderedDict()
+        with self._lock:
+            self._data.clear()
+
+
+class CachePolicy(object):
+    """
+    Caching rules for the URLs matching a pattern. Each adapter backs each
+    policy with a `RoboCache` of its own, so budgets don't compete across
+    policies, and a policy may be shared between adapters. Parameters left
+    as None fall back to the adapter's defaults.
+
+    :param timedelta max_age: Max age of entries
+    :param int max_count: Max number of entries
+    :param int max_bytes: Max total size of cached bodies, in bytes
+    :param list codes: Cacheable status codes; defaults to `CACHE_CODES`
+    :param list verbs: Cacheable request methods; defaults to `CACHE_VERBS`.
+        Entries for other methods are keyed by method and URL only, so
+        only add methods whose responses don't depend on the request body
+    :param BaseStorage storage: Storage backend for this policy's cache
+    :param dict negative_ttls: TTLs for caching error responses; see
+        `RoboCache`
+
+    """
+    def __init__(self, max_age=None, max_count=None, max_bytes=None,
+                 codes=None, verbs=None, storage=None, negative_ttls=None):
+        self.max_age = max_age
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.negative_ttls = negative_ttls
+        self.codes = codes
+        self.verbs = verbs
+        self.storage = storage
+
+    def __repr__(self):
+        return '<CachePolicy max_age={0!r} max_count={1!r}>'.format(
+            self.max_age, self.max_count)
+
+    def build_cache(self, **defaults):
+        """Create the cache backing this policy.
+
+        :param defaults: `RoboCache` arguments for unset parameters
+        :return: RoboCache
+
+        """
+        options = dict(defaults)
+        for name in ('max_age', 'max_count', 'max_bytes', 'negative_ttls'):
+            if getattr(self, name) is not None:
+                options[name] = getattr(self, name)
+        return RoboCache(
+            codes=self.codes, verbs=self.verbs, storage=self.storage,
+            **options)
+
+
+def _combinable(pattern):
+    """Whether a compiled pattern can join an alternation without changing
+    its meaning: it has no flags, inline or passed, and no groups that
+    backreferences or group names could depend on.
+
+    """
+    default_flags = re.compile(pattern.pattern[:0]).flags
+    return (
+        isinstance(pattern.pattern, string_types) and
+        pattern.flags == default_flags and
+        not pattern.groups
+    )
+
+
+class PolicyMatcher(object):
+    """
+    Find the `CachePolicy` for a URL among many patterns. Patterns are URL
+    prefixes or compiled regular expressions. Regular expressions are tried
+    first, in the order given; otherwise the longest matching prefix wins.
+    Runs of expressions without flags or groups are combined into a single
+    alternation; the others are tried one by one. Prefixes are looked up by
+    hashing, once per distinct prefix length, so matching cost doesn't grow
+    with the number of patterns.
+
+    :param patterns: dict or list of (pattern, policy) pairs. A `None`
+        policy marks URLs that must never be cached
+
+    """
+    def __init__(self, patterns):
+        if isinstance(patterns, dict):
+            patterns = list(patterns.items())
+        self.policies = []
+        self._prefixes = {}
+        regexes = []
+        for pattern, policy in patterns:
+            self.policies.append(policy)
+            if isinstance(pattern, string_types):
+                self._prefixes[pattern] = policy
+            else:
+                regexes.append((pattern, policy))
+        self._lengths = sorted(
+            set(len(prefix) for prefix in self._prefixes), reverse=True)
+        # List of (regex, policies); a match's `lastgroup` indexes the
+        # policies of a combined regex
+        self._regexes = []
+        run = []
+        for pattern, policy in regexes:
+            if _combinable(pattern):
+                run.append((pattern, policy))
+                continue
+            self._add_run(run)
+            run = []
+            self._regexes.append((pattern, [policy]))
+        self._add_run(run)
+
+    def _add_run(self, run):
+        if len(run) == 1:
+            self._regexes.append((run[0][0], [run[0][1]]))
+        elif run:
+            self._regexes.append((
+                re.compile('|'.join(
+                    '(?P<p{0}>{1})'.format(idx, pattern.pattern)
+                    for idx, (pattern, _) in enumerate(run)
+                )),
+                [policy for _, policy in run],
+            ))
+
+    def __len__(self):
+        return len(self.policies)
+
+    def match(self, url):
+        """Policy for a URL, or None if no pattern matches.
+
+        :param str url: URL
+        :return: CachePolicy
+
+        """
+        for regex, policies in self._regexes:
+            match = regex.match(url)
+            if match is not None:
+                if len(policies) == 1:
+                    return policies[0]
+                return policies[int(match.lastgroup[1:])]
+        for length in self._lengths:
+            policy = self._prefixes.get(url[:length], _MISSING)
+            if policy is not _MISSING:
+                return policy
+        return None
+
+
+class _Flight(object):
+    """A fetch in progress, shared by concurrent identical requests."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
 
 class RoboHTTPAdapter(HTTPAdapter):
+    """Transport adapter answering from a `RoboCache`. Concurrent identical
+    cacheable requests that miss are coalesced: one thread fetches, and the
+    rest wait for and share its response. Stale entries inside the
+    `stale_while_revalidate` window are served at once and refreshed on a
+    background thread pool, at most one refresh per key at a time.
+
+    With `policies`, each URL is cached under the policy it matches, in a
+    cache of its own; URLs matching no policy, or a `None` policy, are not
+    cached. The remaining cache parameters are defaults for every policy.
 
-    def __init__(self, max_age=None, max_count=None, **kwargs):
+    :param policies: `PolicyMatcher`, or anything it accepts
+    :param cache: Ready-made `RoboCache` or `TieredCache` to use instead
+        of building one from the cache parameters
+    :param int refresh_workers: Number of background refresh threads
+
+    """
+    def __init__(self, max_age=None, max_count=None, max_bytes=None,
+                 storage=None, respect_headers=False,
+                 stale_while_revalidate=None, compression=None,
+                 normalize=None, negative_ttls=None, policies=None,
+                 cache=None, refresh_workers=2, **kwargs):
         super(RoboHTTPAdapter, self).__init__(**kwargs)
-        self.cache = RoboCache(max_age=max_age, max_count=max_count)
+        defaults = dict(
+            max_age=max_age, max_count=max_count, max_bytes=max_bytes,
+            respect_headers=respect_headers,
+            stale_while_revalidate=stale_while_revalidate,
+            compression=compression, normalize=normalize,
+            negative_ttls=negative_ttls)
+        # Cache backing each policy, by policy id; policies are left
+        # untouched, so they can be shared between adapters
+        self._policy_caches = {}
+        if cache is not None:
+            self.policies = None
+            self.cache = cache
+        elif policies is None:
+            self.policies = None
+            self.cache = RoboCache(storage=storage, **defaults)
+        else:
+            if storage is not None:
+                raise ValueError('Pass storage to each `CachePolicy` when '
+                                 'using policies')
+            if not isinstance(policies, PolicyMatcher):
+                policies = PolicyMatcher(policies)
+            self.policies = policies
+            self.cache = None
+            for policy in policies.policies:
+                if policy is not None and \
+                        id(policy) not in self._policy_caches:
+                    self._policy_caches[id(policy)] = policy.build_cache(
+                        **defaults)
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self.refresh_workers = refresh_workers
+        self._refresher = None
+        self._refreshing = set()
+
+    def cache_for(self, url):
+        """Cache responsible for a URL, or None if it isn't cached.
+
+        :param str url: Request URL
+        :return: RoboCache
+
+        """
+        if self.policies is None:
+            return self.cache
+        policy = self.policies.match(url)
+        if policy is None:
+            return None
+        return self._policy_caches[id(policy)]
+
+    def _retrieve(self, cache, request, count=True):
+        cached_resp = cache.retrieve(request, count=count)
+        # Responses rebuilt from persistent storage have no request
+        if cached_resp is not None and cached_resp.request is None:
+            cached_resp.request = request
+        return cached_resp
 
     def send(self, request, **kwargs):
-        cached_resp = self.cache.retrieve(request)
+        cache = self.cache_for(request.url)
+        if cache is None:
+            return super(RoboHTTPAdapter, self).send(request, **kwargs)
+        cached_resp = self._retrieve(cache, request)
         if cached_resp is not None:
             return cached_resp
-        else:
-            return super(RoboHTTPAdapter, self).send(request, **kwargs)
+        if request.method not in cache.verbs or kwargs.get('stream'):
+            return self._fetch(cache, request, **kwargs)
+        key = cache._lookup_key(request)
+        if key is None:
+            return self._fetch(cache, request, **kwargs)
+        stale_resp = cache.retrieve_stale(request)
+        if stale_resp is not None:
+            self._refresh_later(cache, key, request, kwargs)
+            if stale_resp.request is None:
+                stale_resp.request = request
+            return stale_resp
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.response is not None:
+                return flight.response
+            # The leading fetch failed; try again independently
+            return self._fetch(cache, request, **kwargs)
+        try:
+            # Another leader may have filled the cache since the lookup,
+            # which was already counted
+            flight.response = (
+                self._retrieve(cache, request, count=False) or
+                self._fetch(cache, request, **kwargs))
+            return flight.response
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _refresh_later(self, cache, key, request, kwargs):
+        """Schedule a background refresh of a stale entry, unless one is
+        already running for its key.
+
+        """
+        with self._flights_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(self.refresh_workers)
+            self._refresher.submit(
+                self._refresh, cache, key, request.copy(), kwargs)
 
-    def build_response(self, request, response):
-        resp = super(RoboHTTPAdapter, self).build_response(request, response)
-        self.cache.store(resp)
+    def _refresh(self, cache, key, request, kwargs):
+        try:
+            self._fetch(cache, request, **kwargs)
+        except Exception as error:
+            logger.warning(
+                'Background refresh of {0} failed: {1}'.format(
+                    request.url, error))
+        finally:
+            with self._flights_lock:
+                self._refreshing.discard(key)
+
+    def close(self):
+        with self._flights_lock:
+            refresher, self._refresher = self._refresher, None
+        if refresher is not None:
+            refresher.shutdown(wait=True)
+        super(RoboHTTPAdapter, self).close()
+
+    def _fetch(self, cache, request, **kwargs):
+        validators = cache.validators(request)
+        if validators:
+            conditional = request.copy()
+            conditional.headers.update(validators)
+            resp = super(RoboHTTPAdapter, self).send(conditional, **kwargs)
+            if resp.status_code == 304:
+                resp.close()
+                cached_resp = cache.refresh(request, resp)
+                if cached_resp is not None:
+                    if cached_resp.request is None:
+                        cached_resp.request = request
+                    return cached_resp
+                # The entry was evicted since its validators were read;
+                # the caller didn't ask for a 304, so fetch in full
+                resp = super(RoboHTTPAdapter, self).send(request, **kwargs)
+        else:
+            resp = super(RoboHTTPAdapter, self).send(request, **kwargs)
+        # Streamed bodies are consumed by the caller, so don't cache them
+        if not kwargs.get('stream'):
+            # Read the body before taking the cache lock
+            resp.content
+            cache.store(resp)
         return resp
@@ -1,7 +1,11 @@
+import os
 import sys
+import time
 
 PY2 = int(sys.version[0]) == 2
 PY26 = PY2 and int(sys.version_info[1]) < 7
+# `async def` syntax, needed by the aio module
+PY35 = sys.version_info >= (3, 5)
 
 if PY26:
     from .ordereddict import OrderedDict
@@ -9,12 +13,29 @@ else:
     from collections import OrderedDict
 OrderedDict = OrderedDict
 
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+MutableMapping = MutableMapping
+
+# CPU time of the calling thread, or of the process where unsupported
+cpu_time = (
+    getattr(time, 'thread_time', None) or
+    getattr(time, 'process_time', None) or
+    time.clock
+)
+
 
 if PY2:
     import urlparse
+    from urllib import unquote
     urlparse = urlparse
+    unquote = unquote
+    replace_file = os.rename
     string_types = (str, unicode)
     unicode = unicode
+    unichr = unichr
     basestring = basestring
     iterkeys = lambda d: d.iterkeys()
     itervalues = lambda d: d.itervalues()
@@ -23,8 +44,11 @@ if PY2:
 else:
     import urllib.parse
     urlparse = urllib.parse
+    unquote = urllib.parse.unquote
+    replace_file = os.replace
     string_types = (str,)
     unicode = str
+    unichr = chr
     basestring = (str, bytes)
     iterkeys = lambda d: iter(d.keys())
     itervalues = lambda d: iter(d.values())
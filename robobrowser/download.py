@@ -0,0 +1,551 @@
+"""
+Streaming file downloads for robotic browsers.
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from robobrowser import exceptions
+from robobrowser.compat import replace_file, unicode, unquote, urlparse
+
+# Records the file name, ETag and size of URLs written by `download_all`
+MANIFEST_NAME = '.robobrowser-downloads.json'
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class DownloadResult(object):
+    """Outcome of a download; also passed to progress callbacks while the
+    download is running.
+
+    :param str url: Downloaded URL
+    :param str path: Path of the file on disk
+
+    Attributes
+    ----------
+    size : int
+        Bytes in the file on disk
+    total : int
+        Expected size of the file, if known
+    transferred : int
+        Bytes received over the network by this download
+    resumed : bool
+        Whether a partial file was continued
+    elapsed : float
+        Seconds spent downloading
+    checksum : str
+        Hex digest of the complete file
+    segments : int
+        Number of concurrent range requests used
+    skipped : bool
+        Whether `download_all` kept an existing, up-to-date file
+    error : Exception
+        Exception raised by the download, in `download_all` reports
+
+    """
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.size = 0
+        self.total = None
+        self.transferred = 0
+        self.resumed = False
+        self.elapsed = 0.0
+        self.checksum = None
+        self.status_code = None
+        self.segments = 1
+        self.skipped = False
+        self.error = None
+
+    def __repr__(self):
+        return '<DownloadResult url={0} size={1} elapsed={2:.3f}>'.format(
+            self.url, self.size, self.elapsed)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def throughput(self):
+        """Network throughput, in bytes per second."""
+        if not self.elapsed:
+            return None
+        return self.transferred / self.elapsed
+
+
+def _resume_path(path):
+    return path + '.resume'
+
+
+def _read_validator(path):
+    """Read the validator saved for a partial download, if any."""
+    try:
+        with io.open(_resume_path(path), 'r', encoding='utf-8') as fp:
+            return json.load(fp).get('validator')
+    except (EnvironmentError, ValueError):
+        return None
+
+
+def _write_validator(path, response):
+    """Save the ETag or Last-Modified of a download so it can be resumed
+    safely with `If-Range`.
+
+    """
+    validator = (
+        response.headers.get('ETag') or
+        response.headers.get('Last-Modified')
+    )
+    if validator and not validator.startswith('W/'):
+        with io.open(_resume_path(path), 'w', encoding='utf-8') as fp:
+            fp.write(unicode(json.dumps({'validator': validator})))
+
+
+def _hash_file(path, hasher, chunk_size):
+    """Feed the contents of an existing file to `hasher`."""
+    with io.open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            hasher.update(chunk)
+
+
+def _content_range_start(response):
+    """Parse the first byte position from a `Content-Range` header."""
+    value = response.headers.get('Content-Range', '')
+    try:
+        return int(value.split()[1].split('-')[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _content_range_total(response):
+    value = response.headers.get('Content-Range', '')
+    try:
+        return int(value.rsplit('/', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _is_encoded(response):
+    """Whether a response body is sent with a content encoding."""
+    encoding = response.headers.get('Content-Encoding', 'identity')
+    return encoding.strip().lower() != 'identity'
+
+
+def stream_download(session, url, path, chunk_size=DEFAULT_CHUNK_SIZE,
+                    resume=False, callback=None, checksum='sha256',
+                    **kwargs):
+    """Stream a URL to disk in chunks, optionally resuming a partial file.
+
+    A partial file is only continued when the validator (ETag or
+    Last-Modified) seen when it was started is known; the request then
+    carries `Range` and `If-Range`, so a changed resource is downloaded from
+    scratch instead of being spliced. Resumable downloads ask for the
+    unencoded representation, since ranges count encoded bytes. A download
+    that ends short of the announced size raises `RoboError` and can be
+    resumed.
+
+    :param requests.Session session: Session to send requests on
+    :param str url: URL to download
+    :param str path: Destination path
+    :param int chunk_size: Bytes read per chunk
+    :param bool resume: Continue a partial file at `path`
+    :param callback: Optional callable, called with the `DownloadResult`
+        after every chunk
+    :param str checksum: Name of a `hashlib` algorithm
+    :param kwargs: Keyword arguments to `Session::get`
+    :return: DownloadResult
+
+    """
+    result = DownloadResult(url, path)
+    hasher = hashlib.new(checksum)
+    start = time.time()
+
+    offset = 0
+    validator = None
+    if resume and os.path.exists(path):
+        offset = os.path.getsize(path)
+        validator = _read_validator(path)
+    headers = dict(kwargs.pop('headers', None) or {})
+    if resume:
+        headers.setdefault('Accept-Encoding', 'identity')
+    if offset and validator:
+        headers['Range'] = 'bytes={0}-'.format(offset)
+        headers['If-Range'] = validator
+    else:
+        offset = 0
+
+    response = session.get(url, stream=True, headers=headers, **kwargs)
+    try:
+        result.status_code = response.status_code
+        if response.status_code == 416 and offset:
+            # Nothing left to fetch if the partial file is already complete
+            if _content_range_total(response) == offset:
+                _hash_file(path, hasher, chunk_size)
+                result.size = result.total = offset
+                result.resumed = True
+                result.elapsed = time.time() - start
+                result.checksum = hasher.hexdigest()
+                os.remove(_resume_path(path))
+                return result
+        response.raise_for_status()
+
+        if response.status_code == 206:
+            if _content_range_start(response) != offset:
+                raise exceptions.RoboError(
+                    'Server resumed download at an unexpected offset')
+            _hash_file(path, hasher, chunk_size)
+            result.resumed = True
+            result.total = _content_range_total(response)
+            mode = 'ab'
+        else:
+            offset = 0
+            length = response.headers.get('Content-Length')
+            result.total = int(length) if length and length.isdigit() else None
+            if _is_encoded(response):
+                # The length counts encoded bytes; the file gets decoded ones
+                result.total = None
+            _write_validator(path, response)
+            mode = 'wb'
+
+        result.size = offset
+        with io.open(path, mode) as fp:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                fp.write(chunk)
+                hasher.update(chunk)
+                result.size += len(chunk)
+                result.transferred += len(chunk)
+                result.elapsed = time.time() - start
+                if callback is not None:
+                    callback(result)
+    finally:
+        response.close()
+
+    if result.total is not None and result.size != result.total:
+        raise exceptions.RoboError(
+            'Download ended after {0} of {1} bytes'.format(
+                result.size, result.total))
+    if os.path.exists(_resume_path(path)):
+        os.remove(_resume_path(path))
+    result.elapsed = time.time() - start
+    result.checksum = hasher.hexdigest()
+    return result
+
+
+class _SegmentError(Exception):
+    """Raised by a segment worker when the server does not honor its range
+    or sends the wrong number of bytes for it.
+
+    """
+    pass
+
+
+def _probe_ranges(session, url, **kwargs):
+    """Check whether a URL supports byte ranges.
+
+    :return: Tuple of (size, validator) if ranges are supported, else None
+
+    """
+    response = session.head(url, allow_redirects=True, **kwargs)
+    response.close()
+    if response.status_code != 200:
+        return None
+    if response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return None
+    length = response.headers.get('Content-Length', '')
+    if not length.isdigit():
+        return None
+    validator = (
+        response.headers.get('ETag') or
+        response.headers.get('Last-Modified')
+    )
+    if validator and validator.startswith('W/'):
+        validator = None
+    return int(length), validator
+
+
+def _fetch_segment(session, url, path, start, end, validator, chunk_size,
+                   on_chunk, **kwargs):
+    """Fetch bytes `start` through `end` and write them at their offset."""
+    headers = dict(kwargs.pop('headers', None) or {})
+    headers['Range'] = 'bytes={0}-{1}'.format(start, end)
+    if validator:
+        headers['If-Range'] = validator
+    response = session.get(url, stream=True, headers=headers, **kwargs)
+    try:
+        if (response.status_code != 206 or
+                _content_range_start(response) != start):
+            raise _SegmentError(url)
+        written = 0
+        with io.open(path, 'r+b') as fp:
+            fp.seek(start)
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                # Don't write past the range into the next segment
+                if written + len(chunk) > end - start + 1:
+                    raise _SegmentError(url)
+                fp.write(chunk)
+                written += len(chunk)
+                on_chunk(len(chunk))
+    finally:
+        response.close()
+    # A short body would leave a hole in the preallocated file
+    if written != end - start + 1:
+        raise _SegmentError(url)
+
+
+def segmented_download(session, url, path, segments=4,
+                       chunk_size=DEFAULT_CHUNK_SIZE, callback=None,
+                       checksum='sha256', **kwargs):
+    """Download a URL as `segments` concurrent byte ranges written into a
+    preallocated file. The server is probed with a HEAD request first; if it
+    does not advertise byte ranges and a length, or a segment comes back
+    without the requested range, the file is fetched with a single
+    `stream_download` instead.
+
+    :param requests.Session session: Session to send requests on
+    :param str url: URL to download
+    :param str path: Destination path
+    :param int segments: Number of concurrent range requests
+    :param int chunk_size: Bytes read per chunk
+    :param callback: Optional callable, called with the `DownloadResult`
+        after every chunk
+    :param str checksum: Name of a `hashlib` algorithm
+    :param kwargs: Keyword arguments to `Session::get`
+    :return: DownloadResult
+
+    """
+    # Ranges refer to the encoded representation; ask for it unencoded
+    headers = dict(kwargs.pop('headers', None) or {})
+    headers.setdefault('Accept-Encoding', 'identity')
+    kwargs['headers'] = headers
+
+    probe = _probe_ranges(session, url, **kwargs)
+    if probe is None or probe[0] < 2 * segments:
+        return stream_download(
+            session, url, path, chunk_size=chunk_size, callback=callback,
+            checksum=checksum, **kwargs)
+    size, validator = probe
+
+    result = DownloadResult(url, path)
+    result.total = size
+    result.status_code = 206
+    result.segments = segments
+    start = time.time()
+    lock = threading.Lock()
+
+    failed = threading.Event()
+
+    def on_chunk(length):
+        if failed.is_set():
+            raise _SegmentError(url)
+        with lock:
+            result.size += length
+            result.transferred += length
+            result.elapsed = time.time() - start
+            if callback is not None:
+                callback(result)
+
+    with io.open(path, 'wb') as fp:
+        fp.truncate(size)
+
+    step = -(-size // segments)
+    ranges = [
+        (offset, min(offset + step, size) - 1)
+        for offset in range(0, size, step)
+    ]
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [
+            executor.submit(
+                _fetch_segment, session, url, path, first, last, validator,
+                chunk_size, on_chunk, **dict(kwargs))
+            for first, last in ranges
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except _SegmentError:
+            # Stop the remaining segments before falling back
+            failed.set()
+            for future in futures:
+                future.cancel()
+    if failed.is_set():
+        return stream_download(
+            session, url, path, chunk_size=chunk_size, callback=callback,
+            checksum=checksum, **kwargs)
+
+    hasher = hashlib.new(checksum)
+    _hash_file(path, hasher, chunk_size)
+    result.elapsed = time.time() - start
+    result.checksum = hasher.hexdigest()
+    return result
+
+
+def _file_name(url):
+    """Pick a file name for a URL from the last segment of its path."""
+    path = urlparse.urlsplit(url).path
+    name = os.path.basename(unquote(path))
+    return name or 'index'
+
+
+def _assign_file_names(urls):
+    """Map URLs to distinct file names, suffixing duplicates."""
+    names = {}
+    taken = set([MANIFEST_NAME])
+    for url in urls:
+        name = _file_name(url)
+        stem, ext = os.path.splitext(name)
+        idx = 1
+        while name in taken:
+            name = '{0}-{1}{2}'.format(stem, idx, ext)
+            idx += 1
+        taken.add(name)
+        names[url] = name
+    return names
+
+
+def _read_manifest(directory):
+    """Read the manifest, mapping URLs to the files written for them.
+    Manifests keyed by file name are converted.
+
+    """
+    try:
+        with io.open(os.path.join(directory, MANIFEST_NAME), 'r',
+                     encoding='utf-8') as fp:
+            manifest = json.load(fp)
+    except (EnvironmentError, ValueError):
+        return {}
+    for key, entry in list(manifest.items()):
+        if 'name' not in entry:
+            del manifest[key]
+            if entry.get('url'):
+                manifest[entry['url']] = dict(entry, name=key)
+    return manifest
+
+
+def _write_manifest(directory, manifest):
+    """Write the manifest through a temporary file, so it is never left
+    half-written.
+
+    """
+    path = os.path.join(directory, MANIFEST_NAME)
+    with io.open(path + '.tmp', 'w', encoding='utf-8') as fp:
+        fp.write(unicode(json.dumps(manifest, indent=2, sort_keys=True)))
+    replace_file(path + '.tmp', path)
+
+
+def _is_current(path, entry, url, response):
+    """Decide whether an existing file matches the remote resource, by ETag
+    when both sides know it, else by size. Files last written for another
+    URL are never current.
+
+    """
+    if not os.path.exists(path):
+        return False
+    if entry.get('url') != url or entry.get('name') != os.path.basename(path):
+        return False
+    if response is None or response.status_code != 200:
+        return False
+    etag = response.headers.get('ETag')
+    if etag and entry.get('etag'):
+        return entry['etag'] == etag
+    if _is_encoded(response):
+        return False
+    length = response.headers.get('Content-Length', '')
+    return length.isdigit() and int(length) == os.path.getsize(path)
+
+
+def download_all(session, urls, directory, max_workers=4,
+                 chunk_size=DEFAULT_CHUNK_SIZE, checksum='sha256',
+                 callback=None, **kwargs):
+    """Download many URLs into a directory on a bounded pool of workers.
+
+    URLs are deduplicated (ignoring fragments) and saved under the last
+    segment of their path. Files already present with a matching ETag or
+    size are skipped. Each file is streamed to a `.part` file, resuming an
+    earlier partial download where possible, and renamed into place once
+    complete.
+
+    :param requests.Session session: Session to send requests on
+    :param list urls: Full URLs to download
+    :param str directory: Destination directory; created if missing
+    :param int max_workers: Maximum number of concurrent downloads
+    :param int chunk_size: Bytes read per chunk
+    :param str checksum: Name of a `hashlib` algorithm
+    :param callback: Optional callable, called with each `DownloadResult`
+        as its file finishes
+    :param kwargs: Keyword arguments to `Session::get`
+    :return: List of `DownloadResult`, one per distinct URL, in input order
+
+    """
+    unique = []
+    seen = set()
+    for url in urls:
+        url = urlparse.urldefrag(url)[0]
+        if url not in seen:
+            seen.add(url)
+            unique.append(url)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    names = _assign_file_names(unique)
+    manifest = _read_manifest(directory)
+    lock = threading.Lock()
+
+    # Ask for the size of the unencoded file, as stored on disk
+    head_kwargs = dict(kwargs)
+    head_kwargs['headers'] = dict(kwargs.get('headers') or {})
+    head_kwargs['headers'].setdefault('Accept-Encoding', 'identity')
+
+    def fetch(url):
+        name = names[url]
+        path = os.path.join(directory, name)
+        start = time.time()
+        try:
+            try:
+                head = session.head(url, allow_redirects=True, **head_kwargs)
+                head.close()
+            except Exception:
+                head = None
+            with lock:
+                entry = manifest.get(url, {})
+            if _is_current(path, entry, url, head):
+                result = DownloadResult(url, path)
+                result.size = result.total = os.path.getsize(path)
+                result.skipped = True
+            else:
+                result = stream_download(
+                    session, url, path + '.part', chunk_size=chunk_size,
+                    resume=True, checksum=checksum, **kwargs)
+                replace_file(path + '.part', path)
+                result.path = path
+                etag = head.headers.get('ETag') if head is not None else None
+                with lock:
+                    # The file no longer belongs to URLs that used its name
+                    for other, entry in list(manifest.items()):
+                        if entry.get('name') == name:
+                            del manifest[other]
+                    manifest[url] = {
+                        'url': url,
+                        'name': name,
+                        'etag': etag,
+                        'size': result.size,
+                        'checksum': result.checksum,
+                    }
+                    _write_manifest(directory, manifest)
+        except Exception as error:
+            result = DownloadResult(url, path)
+            result.error = error
+        result.elapsed = time.time() - start
+        if callback is not None:
+            callback(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fetch, unique))
@@ -0,0 +1,132 @@
+"""
+Pools of robotic browsers sharing connections.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from robobrowser.browser import RoboBrowser
+
+
+class JobResult(object):
+    """Outcome of a single job run by `RoboBrowserPool::map`.
+
+    :param job: Job passed to the workflow
+    :param result: Return value of the workflow
+    :param Exception error: Exception raised by the workflow, if any
+    :param float elapsed: Latency of the job, in seconds
+
+    """
+    def __init__(self, job, result=None, error=None, elapsed=None):
+        self.job = job
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return '<JobResult job={0!r} ok={1} elapsed={2:.3f}>'.format(
+            self.job, self.ok, self.elapsed or 0)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class RoboBrowserPool(object):
+    """
+    Factory for `RoboBrowser` instances that keep separate sessions, cookies
+    and history but send requests over one shared, sized set of urllib3
+    connection pools.
+
+    Browsers handed out by the pool must not be closed individually, since
+    closing a session closes its adapters; close the pool instead.
+
+    :param int pool_connections: Number of per-host connection pools to keep
+    :param int pool_maxsize: Maximum number of connections kept per host
+    :param bool pool_block: Block when no connection is free instead of
+        opening a throwaway connection
+    :param int tries: Number of retries, shared by all browsers
+    :param int multiplier: Delay multiplier between retries
+    :param kwargs: Default keyword arguments to `RoboBrowser`
+
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False,
+                 tries=None, multiplier=None, **kwargs):
+        self.pool_maxsize = pool_maxsize
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        if tries:
+            self.adapter.max_retries = Retry(tries, backoff_factor=multiplier)
+        self.browser_kwargs = kwargs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def browser(self, **kwargs):
+        """Create a browser with its own session on the shared connections.
+
+        :param kwargs: Keyword arguments to `RoboBrowser`, overriding the
+            pool defaults
+        :return: New `RoboBrowser`
+
+        """
+        if 'session' in kwargs or 'tries' in kwargs:
+            raise ValueError('Sessions and retries are managed by the pool')
+        session = requests.Session()
+        for protocol in ['http://', 'https://']:
+            session.mount(protocol, self.adapter)
+
+        options = dict(self.browser_kwargs)
+        options.update(kwargs)
+        browser = RoboBrowser(session=session, **options)
+
+        # Caching adapters mounted by the browser keep a private cache but
+        # borrow the shared connection pools and retries
+        for adapter in set(browser.session.adapters.values()):
+            if adapter is not self.adapter:
+                adapter.poolmanager.clear()
+                adapter.poolmanager = self.adapter.poolmanager
+                adapter.max_retries = self.adapter.max_retries
+        return browser
+
+    def map(self, func, jobs, max_workers=None):
+        """Run a browser workflow for each job concurrently. Each job gets a
+        fresh browser from the pool and is called as `func(browser, job)`.
+
+        :param func: Workflow callable
+        :param jobs: Iterable of jobs
+        :param int max_workers: Maximum number of concurrent jobs; defaults
+            to the connection pool size
+        :return: List of `JobResult`, in the order of `jobs`
+
+        """
+        max_workers = max_workers or self.pool_maxsize
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._run_job, func, job)
+                for job in jobs
+            ]
+            return [future.result() for future in futures]
+
+    def _run_job(self, func, job):
+        browser = self.browser()
+        start = time.time()
+        try:
+            result = func(browser, job)
+        except Exception as error:
+            return JobResult(job, error=error, elapsed=time.time() - start)
+        return JobResult(job, result=result, elapsed=time.time() - start)
+
+    def close(self):
+        """Close the shared connection pools."""
+        self.adapter.close()
@@ -0,0 +1,246 @@
+"""
+Append-only on-disk storage for responses. Used to spill browser history
+out of memory.
+"""
+
+import io
+import json
+import mmap
+import zlib
+import struct
+import datetime
+import threading
+
+try:
+    import lzma
+except ImportError:  # Python 2
+    lzma = None
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from robobrowser.compat import cpu_time
+
+#: Body compression codecs, by name: (compress, decompress)
+CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+}
+if lzma is not None:
+    CODECS['lzma'] = (lzma.compress, lzma.decompress)
+
+# Each record is a fixed header holding the lengths of the JSON metadata and
+# the body, followed by the metadata and the body
+_HEADER = struct.Struct('!II')
+
+
+class CachedResponse(requests.Response):
+    """
+    Response whose body is held compressed and decompressed on first read
+    of `content`, `text` or `iter_content`. Stored copies are never
+    decompressed: each reader gets its own copy through `unpacked`.
+
+    """
+    def __init__(self):
+        super(CachedResponse, self).__init__()
+        self.codec = None
+        self.packed = None
+        self.stats = None
+
+    @classmethod
+    def pack(cls, response, codec):
+        """Compress a response's body.
+
+        :param requests.Response response: HTTP response
+        :param str codec: Name of a codec in `CODECS`
+        :return: CachedResponse
+
+        """
+        packed = cls()
+        packed.__dict__.update(dict(
+            (name, getattr(response, name, None))
+            for name in ('url', 'status_code', 'reason', 'encoding',
+                         'elapsed', 'request', 'history', 'cookies')
+        ))
+        packed.headers = response.headers.copy()
+        packed.codec = codec
+        packed.packed = CODECS[codec][0](response.content or b'')
+        return packed
+
+    def unpacked(self, stats=None):
+        """Copy sharing the compressed body, to be decompressed on read.
+
+        :param CacheStats stats: Optional stats recording decompression time
+        :return: CachedResponse
+
+        """
+        copy = CachedResponse()
+        copy.__dict__.update(self.__dict__)
+        copy.headers = self.headers.copy()
+        copy.stats = stats
+        return copy
+
+    @property
+    def content(self):
+        if self._content is False and self.packed is not None:
+            start = cpu_time()
+            self._content = CODECS[self.codec][1](self.packed)
+            self._content_consumed = True
+            if self.stats is not None:
+                self.stats.record_decompress(cpu_time() - start)
+        return super(CachedResponse, self).content
+
+    def iter_content(self, *args, **kwargs):
+        self.content
+        return super(CachedResponse, self).iter_content(*args, **kwargs)
+
+
+def serialize_response(response):
+    """Split a response into JSON-serializable metadata and body bytes.
+    Compressed `CachedResponse` bodies are kept compressed.
+
+    :param requests.Response response: HTTP response
+    :return: Tuple of (metadata dict, body bytes)
+
+    """
+    elapsed = getattr(response, 'elapsed', None)
+    meta = {
+        'url': response.url,
+        'status_code': response.status_code,
+        'reason': response.reason,
+        'encoding': response.encoding,
+        'headers': list(response.headers.items()),
+        'elapsed': elapsed.total_seconds() if elapsed is not None else None,
+    }
+    if isinstance(response, CachedResponse) and response._content is False:
+        meta['codec'] = response.codec
+        return meta, response.packed
+    return meta, response.content or b''
+
+
+def build_response(meta, body):
+    """Rebuild a response from metadata and body, as produced by
+    `serialize_response`. The rebuilt response has no request or redirect
+    history attached; compressed bodies come back as a `CachedResponse`.
+
+    :param dict meta: Response metadata
+    :param bytes body: Response body
+    :return: requests.Response
+
+    """
+    if meta.get('codec'):
+        response = CachedResponse()
+        response.codec = meta['codec']
+        response.packed = body
+    else:
+        response = requests.Response()
+        response._content = body
+        response._content_consumed = True
+    response.url = meta['url']
+    response.status_code = meta['status_code']
+    response.reason = meta['reason']
+    response.encoding = meta['encoding']
+    response.headers = CaseInsensitiveDict(meta['headers'])
+    if meta.get('elapsed') is not None:
+        response.elapsed = datetime.timedelta(seconds=meta['elapsed'])
+    return response
+
+
+class StateStore(object):
+    """
+    Append-only file of serialized responses with an in-memory offset index.
+    Records are self-delimiting, so the index is rebuilt by scanning when an
+    existing file is reopened, unless it is truncated. Reads go through a read-only memory map where
+    the platform allows it, and fall back to regular file reads otherwise.
+
+    :param str path: Path to the store file; created if missing
+    :param bool truncate: Discard records already in the file
+
+    """
+    def __init__(self, path, truncate=False):
+        self.path = path
+        self.index = []
+        self._file = io.open(path, 'w+b' if truncate else 'a+b')
+        self._map = None
+        self._lock = threading.Lock()
+        if not truncate:
+            self._scan()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return '<StateStore path={0!r} records={1}>'.format(
+            self.path, len(self.index))
+
+    def _scan(self):
+        """Rebuild the offset index from the records on disk."""
+        self._file.seek(0, io.SEEK_END)
+        end = self._file.tell()
+        offset = 0
+        while offset + _HEADER.size <= end:
+            self._file.seek(offset)
+            meta_len, body_len = _HEADER.unpack(self._file.read(_HEADER.size))
+            if offset + _HEADER.size + meta_len + body_len > end:
+                break
+            self.index.append((offset, meta_len, body_len))
+            offset += _HEADER.size + meta_len + body_len
+        if offset < end:
+            # Drop a partial record left by an interrupted write, so new
+            # records stay aligned
+            self._file.truncate(offset)
+
+    def append(self, response):
+        """Write a response to the store.
+
+        :param requests.Response response: HTTP response
+        :return: Record number, for use with `load`
+
+        """
+        meta, body = serialize_response(response)
+        meta = json.dumps(meta).encode('utf-8')
+        with self._lock:
+            self._file.seek(0, io.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(_HEADER.pack(len(meta), len(body)))
+            self._file.write(meta)
+            self._file.write(body)
+            self._file.flush()
+            self.index.append((offset, len(meta), len(body)))
+            return len(self.index) - 1
+
+    def _read(self, start, length):
+        """Read bytes from the store, through the memory map if possible."""
+        end = start + length
+        if self._map is None or len(self._map) < end:
+            if self._map is not None:
+                self._map.close()
+            try:
+                self._map = mmap.mmap(
+                    self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                self._map = None
+        if self._map is not None and len(self._map) >= end:
+            return self._map[start:end]
+        self._file.seek(start)
+        return self._file.read(length)
+
+    def load(self, record):
+        """Rebuild a stored response.
+
+        :param int record: Record number returned by `append`
+        :return: requests.Response
+
+        """
+        offset, meta_len, body_len = self.index[record]
+        with self._lock:
+            data = self._read(offset + _HEADER.size, meta_len + body_len)
+        meta = json.loads(data[:meta_len].decode('utf-8'))
+        return build_response(meta, data[meta_len:])
+
+    def close(self):
+        """Close the memory map and the underlying file."""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
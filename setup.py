@@ -14,6 +14,9 @@ REQUIREMENTS = [
     'six>=1.9.0',
     'Werkzeug>=0.10.4',
 ]
+if sys.version_info < (3, 2):
+    # Backport of `concurrent.futures`
+    REQUIREMENTS.append('futures>=3.0.0')
 TEST_REQUIREMENTS = [
     'coverage',
     'coveralls',
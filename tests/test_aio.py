@@ -0,0 +1,80 @@
+import unittest
+from nose.tools import *  # noqa
+
+import re
+import asyncio
+
+from robobrowser.aio import AsyncRoboBrowser
+
+from tests.fixtures import mock_links, mock_urls, mock_forms
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestAsyncBrowser(unittest.TestCase):
+
+    def setUp(self):
+        self.browser = AsyncRoboBrowser(max_workers=4)
+
+    def tearDown(self):
+        self.browser.close()
+
+    @staticmethod
+    async def _gather(*coros):
+        return await asyncio.gather(*coros)
+
+    @mock_urls
+    def test_open(self):
+        run(self.browser.open('http://robobrowser.com/page1/'))
+        assert_equal(self.browser.url, 'http://robobrowser.com/page1/')
+        assert_equal(len(self.browser._states), 1)
+
+    @mock_urls
+    def test_concurrent_open(self):
+        urls = [
+            'http://robobrowser.com/page{0}/'.format(idx)
+            for idx in range(1, 5)
+        ]
+        run(self._gather(*[self.browser.open(url) for url in urls]))
+        assert_equal(len(self.browser._states), 4)
+        assert_equal(
+            sorted(state.url for state in self.browser._states),
+            urls
+        )
+
+    @mock_links
+    def test_follow_link(self):
+        run(self.browser.open('http://robobrowser.com/links/'))
+        link = self.browser.get_link(text=re.compile('sheer'))
+        run(self.browser.follow_link(link))
+        assert_equal(self.browser.url, 'http://robobrowser.com/link1/')
+        self.browser.back()
+        assert_equal(self.browser.url, 'http://robobrowser.com/links/')
+
+    @mock_urls
+    def test_open_many(self):
+        urls = ['http://robobrowser.com/page2/', 'http://robobrowser.com/page1/']
+        states = run(self.browser.open_many(urls, max_workers=1))
+        assert_equal([state.url for state in states], urls)
+        assert_equal(len(self.browser._states), 0)
+
+    @mock_forms
+    def test_submit_form(self):
+        run(self.browser.open('http://robobrowser.com/post_form/'))
+        form = self.browser.get_form()
+        run(self.browser.submit_form(form))
+        assert_equal(self.browser.url, 'http://robobrowser.com/submit/')
+        assert_equal(len(self.browser._states), 2)
+
+    def test_connection_pools_sized(self):
+        browser = AsyncRoboBrowser(max_workers=50, cache=True)
+        adapter = browser.session.adapters['http://']
+        assert_equal(adapter.poolmanager.connection_pool_kw['maxsize'], 50)
+        assert_true(browser.session.adapters['https://'] is adapter)
+        browser.close()
@@ -0,0 +1,373 @@
+import unittest
+from nose.tools import *  # noqa
+
+import os
+import time
+import shutil
+import multiprocessing
+import sqlite3
+import datetime
+import tempfile
+
+import requests
+
+from robobrowser.browser import RoboBrowser
+from robobrowser.cache import RoboCache, TieredCache
+from robobrowser.backends import MemoryStorage, SQLiteStorage, encode_entry
+
+from tests.utils import KwargSetter, FileAdapter, serve
+
+
+def make_response(url, body=b'<p>queen</p>', status_code=200):
+    response = requests.Response()
+    response.url = url
+    response.status_code = status_code
+    response.reason = 'OK'
+    response.encoding = 'utf-8'
+    response.headers['Content-Type'] = 'text/html'
+    response._content = body
+    return response
+
+
+class TestMemoryStorage(unittest.TestCase):
+
+    def test_popitem_oldest(self):
+        storage = MemoryStorage()
+        for idx in range(3):
+            storage[idx] = {'response': idx}
+        assert_equal(storage.popitem(last=False)[0], 0)
+        assert_equal(list(storage.keys()), [1, 2])
+
+
+class TestMemoryDeduplication(unittest.TestCase):
+
+    def test_shared_blob(self):
+        storage = MemoryStorage()
+        first = make_response('http://robobrowser.com/?sid=1', body=b'same')
+        second = make_response('http://robobrowser.com/?sid=2', body=b'same')
+        second._content = b''.join([b'sa', b'me'])
+        storage['a'] = {'response': first}
+        storage['b'] = {'response': second}
+        assert_equal(storage.blob_count, 1)
+        assert_equal(storage.blob_bytes, 4)
+        assert_true(second._content is first._content)
+        del storage['a']
+        assert_equal(storage.blob_count, 1)
+        storage.popitem()
+        assert_equal(storage.blob_count, 0)
+
+
+class TestSQLiteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'cache.db')
+        self.storage = SQLiteStorage(self.path)
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_roundtrip(self):
+        date = datetime.datetime.now()
+        self.storage['key'] = {
+            'date': date, 'response': make_response('http://robobrowser.com/'),
+        }
+        entry = self.storage['key']
+        assert_true(abs(entry['date'] - date) < datetime.timedelta(seconds=0.01))
+        response = entry['response']
+        assert_equal(response.status_code, 200)
+        assert_equal(response.content, b'<p>queen</p>')
+        assert_equal(response.headers['content-type'], 'text/html')
+        assert_equal(response.url, 'http://robobrowser.com/')
+
+    def test_order_and_popitem(self):
+        for idx in range(3):
+            self.storage[idx] = {
+                'date': datetime.datetime.now(),
+                'response': make_response('http://robobrowser.com/'),
+            }
+        # Replacing an entry keeps its position
+        self.storage[0] = self.storage[0]
+        assert_equal(list(self.storage.keys()), [0, 1, 2])
+        assert_equal(self.storage.popitem(last=False)[0], 0)
+        assert_equal(self.storage.popitem()[0], 2)
+        assert_equal(len(self.storage), 1)
+        del self.storage[1]
+        assert_false(1 in self.storage)
+        assert_raises(KeyError, lambda: self.storage[1])
+
+    def test_touch(self):
+        for idx in range(3):
+            self.storage[idx] = {
+                'date': datetime.datetime.now(),
+                'response': make_response('http://robobrowser.com/'),
+            }
+        self.storage.touch(0)
+        assert_equal(list(self.storage.keys()), [1, 2, 0])
+        assert_equal(self.storage.popitem(last=False)[0], 1)
+
+    def test_compressed_body_kept_compressed(self):
+        cache = RoboCache(storage=self.storage, compression='zlib')
+        body = b'<p>queen</p>' * 1000
+        cache.store(make_response('http://robobrowser.com/', body=body))
+        stored = self.storage._query('SELECT body FROM blobs')[0][0]
+        assert_true(len(stored) < len(body) / 10)
+        request = requests.Request('GET', 'http://robobrowser.com/')
+        assert_equal(cache.retrieve(request.prepare()).content, body)
+
+    def test_shared_blob(self):
+        for idx in range(3):
+            self.storage[idx] = {
+                'date': datetime.datetime.now(),
+                'response': make_response('http://robobrowser.com/'),
+            }
+        assert_equal(self.storage.blob_count, 1)
+        # Replacing an entry with the same body keeps the blob
+        self.storage[0] = self.storage[0]
+        assert_equal(self.storage.blob_count, 1)
+        self.storage[0] = {
+            'date': datetime.datetime.now(),
+            'response': make_response('http://robobrowser.com/', body=b'new'),
+        }
+        assert_equal(self.storage.blob_count, 2)
+        del self.storage[1]
+        self.storage.popitem()
+        assert_equal(self.storage.blob_count, 1)
+        assert_equal(self.storage[0]['response'].content, b'new')
+        self.storage.popitem()
+        assert_equal(self.storage.blob_count, 0)
+
+    def test_migrate_inline_bodies(self):
+        self.storage.close()
+        os.remove(self.path)
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute(
+                'CREATE TABLE entries ('
+                'key PRIMARY KEY, seq INTEGER, meta TEXT, body BLOB)')
+            meta, body = encode_entry({
+                'date': datetime.datetime.now(),
+                'response': make_response('http://robobrowser.com/'),
+            })
+            conn.execute(
+                'INSERT INTO entries VALUES (?, 1, ?, ?)',
+                ('key', meta, sqlite3.Binary(body)))
+        conn.close()
+        self.storage = SQLiteStorage(self.path)
+        assert_equal(self.storage['key']['response'].content, b'<p>queen</p>')
+        assert_equal(self.storage.blob_count, 1)
+        self.storage['other'] = self.storage['key']
+        assert_equal(self.storage.popitem(last=False)[0], 'key')
+
+    def test_tiered_cache_persists_l1(self):
+        cache = TieredCache(l2=RoboCache(storage=self.storage))
+        cache.store(make_response('http://robobrowser.com/'))
+        assert_equal(len(self.storage), 0)
+        cache.close()
+        self.storage = SQLiteStorage(self.path)
+        cache = TieredCache(l2=RoboCache(storage=self.storage))
+        request = requests.Request('GET', 'http://robobrowser.com/')
+        response = cache.retrieve(request.prepare())
+        assert_equal(response.content, b'<p>queen</p>')
+        # Promotion copies the entry, so the database keeps it
+        assert_equal(len(self.storage), 1)
+
+    def test_iter_meta_skips_responses(self):
+        self.storage['key'] = {
+            'date': datetime.datetime.now(),
+            'response': make_response('http://robobrowser.com/'),
+        }
+        key, entry = list(self.storage.iter_meta())[0]
+        assert_equal(key, 'key')
+        assert_false('response' in entry)
+
+    def test_cache_survives_restart(self):
+        cache = RoboCache(storage=self.storage)
+        cache.store(make_response('http://robobrowser.com/'))
+        self.storage.close()
+
+        self.storage = SQLiteStorage(self.path)
+        cache = RoboCache(storage=self.storage)
+        request = KwargSetter(url='http://robobrowser.com/', method='GET')
+        retrieved = cache.retrieve(request)
+        assert_equal(retrieved.content, b'<p>queen</p>')
+
+    def test_cache_limits(self):
+        cache = RoboCache(max_count=2, storage=self.storage)
+        for idx in range(4):
+            cache.store(make_response('http://robobrowser.com/{0}'.format(idx)))
+        assert_equal(
+            list(cache.data.keys()),
+            ['http://robobrowser.com/2', 'http://robobrowser.com/3']
+        )
+
+    def test_browser_cache_storage(self):
+        server = FileAdapter(b'<p>mercury</p>')
+        with serve(server):
+            browser = RoboBrowser(cache=True, cache_storage=self.storage)
+            browser.open('http://robobrowser.com/')
+            browser.open('http://robobrowser.com/')
+        assert_equal(len(server.requests), 1)
+        assert_equal(browser.find('p').text, 'mercury')
+        assert_true(browser.response.request is not None)
+
+
+def store_pages(path, worker, count):
+    cache = RoboCache(
+        storage=SQLiteStorage(path, shared=True), max_count=50)
+    for idx in range(count):
+        url = 'http://robobrowser.com/{0}/{1}'.format(worker, idx)
+        cache.store(make_response(url))
+        cache.retrieve(requests.Request('GET', url).prepare())
+    cache.data.close()
+
+
+class TestSharedSQLiteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_wal_mode(self):
+        storage = SQLiteStorage(self.path, shared=True)
+        mode = storage._query('PRAGMA journal_mode')[0][0]
+        storage.close()
+        assert_equal(mode, 'wal')
+
+    def test_entries_visible_across_connections(self):
+        first = RoboCache(storage=SQLiteStorage(self.path, shared=True))
+        second = RoboCache(storage=SQLiteStorage(self.path, shared=True))
+        first.store(make_response('http://robobrowser.com/'))
+        request = requests.Request('GET', 'http://robobrowser.com/')
+        response = second.retrieve(request.prepare())
+        assert_equal(response.content, b'<p>queen</p>')
+        first.data.close()
+        second.data.close()
+
+    def test_vary_read_across_connections(self):
+        first = RoboCache(storage=SQLiteStorage(self.path, shared=True),
+                          respect_headers=True)
+        second = RoboCache(storage=SQLiteStorage(self.path, shared=True),
+                           respect_headers=True)
+        request = requests.Request(
+            'GET', 'http://robobrowser.com/',
+            headers={'Accept-Language': 'fr'}).prepare()
+        response = make_response('http://robobrowser.com/')
+        response.headers['Cache-Control'] = 'max-age=60'
+        response.headers['Vary'] = 'Accept-Language'
+        response.request = request
+        first.store(response)
+        assert_equal(second.retrieve(request).content, b'<p>queen</p>')
+        english = request.copy()
+        english.headers['Accept-Language'] = 'en'
+        assert_equal(second.retrieve(english), None)
+        first.data.close()
+        second.data.close()
+
+    def test_limits_enforced_across_connections(self):
+        caches = [
+            RoboCache(storage=SQLiteStorage(self.path, shared=True),
+                      max_count=3)
+            for _ in range(2)
+        ]
+        for idx in range(6):
+            caches[idx % 2].store(
+                make_response('http://robobrowser.com/{0}'.format(idx)))
+        assert_equal(
+            list(caches[0].data.keys()),
+            ['http://robobrowser.com/{0}'.format(idx) for idx in (3, 4, 5)])
+        assert_equal(caches[0].data.blob_count, 1)
+        for cache in caches:
+            cache.data.close()
+
+    def test_summary_covers_other_connections(self):
+        first = RoboCache(storage=SQLiteStorage(self.path, shared=True))
+        second = RoboCache(storage=SQLiteStorage(self.path, shared=True))
+        first.store(make_response('http://robobrowser.com/1'))
+        second.store(make_response('http://robobrowser.com/2'))
+        summary = first.summary()
+        assert_equal(summary['count'], 2)
+        assert_equal(summary['stores'], 1)
+        first.data.close()
+        second.data.close()
+
+    def test_enforce_max_age(self):
+        storage = SQLiteStorage(self.path, shared=True)
+        now = datetime.datetime.now()
+        for idx, age in enumerate((0, 10, 20)):
+            storage[idx] = {
+                'date': now - datetime.timedelta(minutes=age), 'size': 1,
+                'response': make_response('http://robobrowser.com/'),
+            }
+        evicted = storage.enforce(
+            min_date=now - datetime.timedelta(minutes=15))
+        assert_equal(evicted, [2])
+        assert_equal(storage.enforce(max_bytes=1), [0])
+        storage.close()
+
+    def test_totals_track_entries(self):
+        storage = SQLiteStorage(self.path, shared=True)
+        for idx in range(3):
+            storage[idx] = {
+                'date': datetime.datetime.now(), 'size': 10,
+                'response': make_response('http://robobrowser.com/'),
+            }
+        storage[0] = dict(storage[0], size=25)
+        del storage[1]
+        assert_equal(storage._query('SELECT count, bytes FROM totals'),
+                     [(2, 35)])
+        assert_equal(storage.enforce(max_bytes=20), [0])
+        assert_equal(storage._query('SELECT count, bytes FROM totals'),
+                     [(1, 10)])
+        storage.close()
+
+    def test_touch_skipped_while_locked(self):
+        storage = SQLiteStorage(self.path, shared=True)
+        storage['a'] = {
+            'date': datetime.datetime.now(), 'size': 1,
+            'response': make_response('http://robobrowser.com/'),
+        }
+        storage['b'] = dict(storage['a'])
+        other = SQLiteStorage(self.path, shared=True)
+        other._conn.execute('BEGIN IMMEDIATE')
+        start = time.time()
+        storage.touch('a')
+        assert_true(time.time() - start < 1)
+        other._conn.execute('ROLLBACK')
+        assert_equal(list(storage.keys()), ['a', 'b'])
+        storage.touch('a')
+        assert_equal(list(storage.keys()), ['b', 'a'])
+        other.close()
+        storage.close()
+
+    def test_cache_skips_local_index(self):
+        cache = RoboCache(
+            storage=SQLiteStorage(self.path, shared=True), max_count=2)
+        for idx in range(4):
+            cache.store(
+                make_response('http://robobrowser.com/{0}'.format(idx)))
+        assert_equal(len(cache.data), 2)
+        assert_equal(cache._dates, {})
+        assert_equal(cache._expiry, [])
+        cache.data.close()
+
+    def test_concurrent_processes(self):
+        SQLiteStorage(self.path, shared=True).close()
+        workers = [
+            multiprocessing.Process(
+                target=store_pages, args=(self.path, worker, 40))
+            for worker in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert_true(all(worker.exitcode == 0 for worker in workers))
+        storage = SQLiteStorage(self.path, shared=True)
+        assert_equal(len(storage), 50)
+        assert_equal(storage.blob_count, 1)
+        storage.close()
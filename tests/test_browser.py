@@ -2,11 +2,15 @@ import mock
 import unittest
 from nose.tools import *  # noqa
 
+import os
 import re
+import shutil
+import tempfile
 import requests
 from bs4 import BeautifulSoup
 
 from robobrowser.browser import RoboBrowser
+from robobrowser.cache import ArtifactCache
 from robobrowser import exceptions
 
 from tests.fixtures import mock_links, mock_urls, mock_forms
@@ -73,6 +77,26 @@ class TestLinks(unittest.TestCase):
         self.browser.follow_link(link)
         assert_equal(self.browser.url, 'http://robobrowser.com/link1/')
 
+    @mock_links
+    def test_follow_links(self):
+        links = self.browser.get_links(href=True)
+        states = self.browser.follow_links(links, max_workers=2)
+        assert_equal(
+            [state.url for state in states],
+            ['http://robobrowser.com/link1/', 'http://robobrowser.com/link2/']
+        )
+        assert_equal(self.browser.url, 'http://robobrowser.com/links/')
+        assert_equal(len(self.browser._states), 1)
+
+    @mock_links
+    def test_open_many_relative(self):
+        states = self.browser.open_many(['/link2/', 'http://robobrowser.com/link1/'])
+        assert_equal(
+            [state.url for state in states],
+            ['http://robobrowser.com/link2/', 'http://robobrowser.com/link1/']
+        )
+        assert_equal(self.browser._cursor, 0)
+
     @mock_links
     def test_follow_link_no_href(self):
         link = BeautifulSoup('<a>nohref</a>').find('a')
@@ -343,3 +367,176 @@ class TestAllowRedirects(unittest.TestCase):
         assert_true(mock_request.called)
         kwargs = mock_request.mock_calls[0][2]
         assert_true(kwargs.get('allow_redirects') is False)
+
+
+def make_response(url, body):
+    response = requests.Response()
+    response.url = url
+    response.status_code = 200
+    response._content = body
+    return response
+
+
+class TestHistoryBudget(unittest.TestCase):
+
+    body = b'<html><body>' + b'<p>queen</p>' * 100 + b'</body></html>'
+
+    def navigate(self, browser, count):
+        for idx in range(count):
+            browser._update_state(make_response(
+                'http://robobrowser.com/page{0}/'.format(idx), self.body))
+            browser.parsed
+
+    def test_no_budget_keeps_everything(self):
+        browser = RoboBrowser()
+        self.navigate(browser, 3)
+        assert_true(all(state.is_parsed for state in browser._states))
+        assert_equal(browser._history_bytes, 0)
+
+    def test_drops_parsed_trees_first(self):
+        browser = RoboBrowser(history_max_bytes=len(self.body) * 20)
+        self.navigate(browser, 3)
+        states = list(browser._states)
+        assert_equal(len(states), 3)
+        assert_equal([state.is_parsed for state in states], [False, False, True])
+        assert_false(any(state.body_released for state in states))
+        assert_true(browser._history_bytes <= browser.history_max_bytes)
+
+    def test_reparse_after_back(self):
+        browser = RoboBrowser(history_max_bytes=len(self.body) * 20)
+        self.navigate(browser, 3)
+        browser.back()
+        assert_equal(len(browser.find_all('p')), 100)
+        assert_true(browser.state.is_parsed)
+        assert_false(browser._states[-1].is_parsed)
+
+    def test_drops_bodies_then_states(self):
+        browser = RoboBrowser(history_max_bytes=len(self.body) * 12 + 2000)
+        self.navigate(browser, 3)
+        states = list(browser._states)
+        assert_equal(len(states), 3)
+        assert_equal(
+            [state.body_released for state in states], [True, True, False])
+        browser.back()
+        assert_raises(exceptions.RoboError, lambda: browser.parsed)
+
+        browser = RoboBrowser(history_max_bytes=len(self.body) * 12)
+        self.navigate(browser, 3)
+        assert_equal(len(browser._states), 1)
+        assert_equal(browser._cursor, 0)
+        assert_equal(browser.url, 'http://robobrowser.com/page2/')
+
+
+class TestHistoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'history.bin')
+        self.browser = RoboBrowser(history_path=self.path, history_resident=1)
+        for idx in range(5):
+            response = make_response(
+                'http://robobrowser.com/page{0}/'.format(idx),
+                '<p>page {0}</p>'.format(idx).encode('utf-8'))
+            response.headers['X-Page'] = str(idx)
+            self.browser._update_state(response)
+
+    def tearDown(self):
+        self.browser.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_spills_outside_window(self):
+        spilled = [state.is_spilled for state in self.browser._states]
+        assert_equal(spilled, [True, True, True, False, False])
+        assert_equal(len(self.browser._history_store), 3)
+
+    def test_back_reloads(self):
+        self.browser.back(4)
+        assert_equal(self.browser.url, 'http://robobrowser.com/page0/')
+        assert_equal(self.browser.find('p').text, 'page 0')
+        assert_equal(self.browser.response.headers['x-page'], '0')
+        spilled = [state.is_spilled for state in self.browser._states]
+        assert_equal(spilled, [False, True, True, True, True])
+
+    def test_new_browser_starts_fresh_file(self):
+        self.browser.close()
+        self.browser = RoboBrowser(history_path=self.path, history_resident=1)
+        assert_equal(len(self.browser._history_store), 0)
+        assert_equal(os.path.getsize(self.path), 0)
+
+    def test_navigate_after_back(self):
+        self.browser.back(2)
+        for idx in range(5, 8):
+            self.browser._update_state(make_response(
+                'http://robobrowser.com/page{0}/'.format(idx),
+                '<p>page {0}</p>'.format(idx).encode('utf-8')))
+            assert_false(self.browser.state.is_spilled)
+        spilled = [state.is_spilled for state in self.browser._states]
+        assert_equal(spilled, [True, True, True, True, False, False])
+
+    def test_forward_reloads_without_rewriting(self):
+        self.browser.back(4)
+        self.browser.parsed
+        self.browser.forward(4)
+        assert_equal(self.browser.find('p').text, 'page 4')
+        assert_equal(len(self.browser._history_store), 5)
+
+
+class TestArtifactCache(unittest.TestCase):
+
+    body = (b'<html><body><a href="/a">a</a><a href="/b">b</a>'
+            b'<form id="f"><input type="text" name="q" /></form></body></html>')
+
+    def setUp(self):
+        self.artifacts = ArtifactCache()
+        self.browser = RoboBrowser(artifact_cache=self.artifacts)
+
+    def visit(self, url, body=None):
+        self.browser._update_state(make_response(url, body or self.body))
+
+    @mock.patch('robobrowser.browser.BeautifulSoup', wraps=BeautifulSoup)
+    def test_identical_bodies_parsed_once(self, soup):
+        self.visit('http://robobrowser.com/1')
+        first = self.browser.parsed
+        self.visit('http://robobrowser.com/2')
+        assert_true(self.browser.parsed is first)
+        self.visit('http://robobrowser.com/3', b'<p>queen</p>')
+        self.browser.parsed
+        assert_equal(soup.call_count, 2)
+        assert_equal(self.artifacts.hits, 1)
+
+    def test_links_and_forms(self):
+        self.visit('http://robobrowser.com/1')
+        links = self.browser.get_links()
+        self.visit('http://robobrowser.com/2')
+        assert_equal(self.browser.get_links(), links)
+        links.pop()
+        assert_equal(len(self.browser.get_links()), 2)
+        forms = self.browser.get_forms()
+        self.visit('http://robobrowser.com/3')
+        again = self.browser.get_forms()
+        assert_equal(len(again), 1)
+        # Forms are built afresh, so filling one doesn't leak
+        again[0]['q'].value = 'king'
+        assert_not_equal(forms[0]['q'].value, 'king')
+        assert_equal(len(self.artifacts), 3)
+
+    def test_shared_between_browsers(self):
+        other = RoboBrowser(artifact_cache=self.artifacts)
+        self.visit('http://robobrowser.com/1')
+        other._update_state(make_response('http://robobrowser.com/1', self.body))
+        assert_true(other.parsed is self.browser.parsed)
+
+    def test_parser_in_key(self):
+        other = RoboBrowser(parser='html.parser', artifact_cache=self.artifacts)
+        self.visit('http://robobrowser.com/1')
+        other._update_state(make_response('http://robobrowser.com/1', self.body))
+        assert_false(other.parsed is self.browser.parsed)
+
+    def test_encoding_in_key(self):
+        body = u'<p>caf\xe9</p>'.encode('utf-8')
+        self.visit('http://robobrowser.com/1', body)
+        self.browser.response.encoding = 'utf-8'
+        assert_equal(self.browser.find('p').text, u'caf\xe9')
+        self.visit('http://robobrowser.com/2', body)
+        self.browser.response.encoding = 'iso-8859-1'
+        assert_equal(self.browser.find('p').text, u'caf\xc3\xa9')
@@ -1,11 +1,19 @@
 import unittest
 from nose.tools import *
 
+import re
+import time
 import datetime
+import threading
+
+import requests
 
 from robobrowser.browser import RoboBrowser
-from robobrowser.cache import RoboCache
-from tests.utils import KwargSetter
+from robobrowser.cache import (
+    RoboCache, RoboHTTPAdapter, TieredCache, KeyNormalizer, CachePolicy,
+    PolicyMatcher, freshness_lifetime, retry_after,
+)
+from tests.utils import KwargSetter, FileAdapter, serve
 
 
 class TestAdapter(unittest.TestCase):
@@ -90,3 +98,773 @@ class TestCache(unittest.TestCase):
         assert_equal(len(self.cache.data), 3)
         # Cast keys to list for 3.3 compatibility
         assert_equal(list(self.cache.data.keys()), [2, 3, 4])
+
+    def test_reduce_age_restored_entry(self):
+        url = 'http://robobrowser.com/'
+        self.cache.store(KwargSetter(url=url, status_code=200))
+        first = self.cache._dates[url]
+        # As if stored again an hour later; the first heap item is stale
+        self.cache._index(url, first + datetime.timedelta(hours=1))
+        self.cache.max_age = datetime.timedelta(minutes=30)
+        self.cache._reduce_age(first + datetime.timedelta(minutes=45))
+        assert_true(url in self.cache.data)
+        assert_equal(len(self.cache._expiry), 1)
+
+    def test_expiry_heap_compacted(self):
+        response = KwargSetter(url='http://robobrowser.com/', status_code=200)
+        for _ in range(1000):
+            self.cache.store(response)
+        assert_equal(len(self.cache.data), 1)
+        assert_true(len(self.cache._expiry) < 100)
+
+    def test_retrieve_promotes_entry(self):
+        for idx in range(3):
+            self.cache.store(KwargSetter(url=idx, status_code=200))
+        self.cache.retrieve(KwargSetter(url=0, method='GET'))
+        self.cache.max_count = 2
+        self.cache.store(KwargSetter(url=3, status_code=200))
+        assert_equal(list(self.cache.data.keys()), [0, 3])
+
+    def test_reduce_bytes(self):
+        self.cache = RoboCache(max_bytes=10)
+        for idx in range(3):
+            self.cache.store(
+                KwargSetter(url=idx, status_code=200, content=b'x' * 4))
+        assert_equal(list(self.cache.data.keys()), [1, 2])
+        assert_equal(self.cache._bytes, 8)
+
+    def test_skip_oversized_entry(self):
+        self.cache = RoboCache(max_bytes=10)
+        self.cache.store(KwargSetter(url=0, status_code=200, content=b'x'))
+        self.cache.store(
+            KwargSetter(url=1, status_code=200, content=b'x' * 11))
+        assert_equal(list(self.cache.data.keys()), [0])
+
+
+def make_response(url='http://robobrowser.com/', request_headers=None,
+                  **headers):
+    request = requests.Request('GET', url, headers=request_headers).prepare()
+    response = requests.Response()
+    response.url = url
+    response.status_code = 200
+    response.request = request
+    response._content = b'<p>queen</p>'
+    for name, value in headers.items():
+        response.headers[name.replace('_', '-')] = value
+    return response
+
+
+class TestCacheStats(unittest.TestCase):
+
+    def setUp(self):
+        self.evicted = []
+        self.stored = []
+        self.cache = RoboCache(
+            max_count=2,
+            on_evict=lambda key, entry, reason: self.evicted.append(
+                (key, reason)),
+            on_store=lambda key, entry: self.stored.append(key))
+
+    def store(self, url, size=10):
+        self.cache.store(
+            KwargSetter(url=url, status_code=200, content=b'x' * size))
+
+    def test_summary(self):
+        self.store('a', size=10)
+        self.store('b', size=30)
+        self.store('c', size=20)
+        self.cache.retrieve(KwargSetter(url='c', method='GET'))
+        self.cache.retrieve(KwargSetter(url='a', method='GET'))
+        summary = self.cache.summary()
+        assert_equal(summary['hits'], 1)
+        assert_equal(summary['misses'], 1)
+        assert_equal(summary['hit_ratio'], 0.5)
+        assert_equal(summary['stores'], 3)
+        assert_equal(summary['evictions'], {'count': 1})
+        assert_equal(summary['count'], 2)
+        assert_equal(summary['bytes'], 50)
+        assert_true(0 <= summary['average_age'] < 1)
+
+    def test_callbacks(self):
+        for url in 'abc':
+            self.store(url)
+        assert_equal(self.stored, ['a', 'b', 'c'])
+        assert_equal(self.evicted, [('a', 'count')])
+
+    def test_age_evictions(self):
+        self.cache.max_age = datetime.timedelta(seconds=60)
+        self.store('a')
+        self.cache.data['a']['date'] -= datetime.timedelta(seconds=90)
+        self.cache._index('a', self.cache.data['a']['date'])
+        self.store('b')
+        assert_equal(self.evicted, [('a', 'age')])
+        assert_equal(self.cache.stats.evictions, {'age': 1})
+
+    def test_keys_by(self):
+        self.cache.max_count = None
+        self.store('a', size=10)
+        self.store('b', size=30)
+        self.store('c', size=20)
+        assert_equal(
+            [key for key, _, _ in self.cache.keys_by('size')],
+            ['b', 'c', 'a'])
+        assert_equal(
+            [key for key, _, _ in self.cache.keys_by('age', limit=2)],
+            ['a', 'b'])
+        assert_raises(ValueError, self.cache.keys_by, 'name')
+
+
+class TestHeaderCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = RoboCache(respect_headers=True)
+
+    def retrieve(self, url='http://robobrowser.com/', **headers):
+        headers = dict(
+            (name.replace('_', '-'), value) for name, value in headers.items())
+        request = requests.Request('GET', url, headers=headers).prepare()
+        return self.cache.retrieve(request)
+
+    def test_freshness_lifetime(self):
+        assert_equal(
+            freshness_lifetime(make_response(Cache_Control='max-age=60')), 60)
+        assert_equal(
+            freshness_lifetime(make_response(
+                Cache_Control='max-age=60, s-maxage=30')), 30)
+        assert_equal(
+            freshness_lifetime(make_response(
+                Cache_Control='max-age=60', Age='20')), 40)
+        assert_equal(
+            freshness_lifetime(make_response(
+                Date='Sun, 06 Nov 1994 08:49:37 GMT',
+                Expires='Sun, 06 Nov 1994 08:50:37 GMT')), 60)
+        assert_equal(
+            freshness_lifetime(make_response(Expires='invalid')), 0)
+        assert_equal(freshness_lifetime(make_response()), None)
+
+    def test_store_fresh(self):
+        response = make_response(Cache_Control='max-age=60')
+        self.cache.store(response)
+        assert_true(self.retrieve() is response)
+
+    def test_skip_without_freshness(self):
+        self.cache.store(make_response())
+        assert_equal(len(self.cache.data), 0)
+
+    def test_skip_no_store_and_private(self):
+        self.cache.store(make_response(Cache_Control='no-store, max-age=60'))
+        self.cache.store(make_response(Cache_Control='private, max-age=60'))
+        assert_equal(len(self.cache.data), 0)
+
+    def test_stale_entry_dropped(self):
+        self.cache.store(make_response(Cache_Control='max-age=60'))
+        key = 'http://robobrowser.com/'
+        self.cache.data[key]['expires'] = datetime.datetime.now()
+        assert_equal(self.retrieve(), None)
+        assert_false(key in self.cache.data)
+
+    def test_request_no_cache_bypasses(self):
+        self.cache.store(make_response(Cache_Control='max-age=60'))
+        assert_equal(self.retrieve(Cache_Control='no-cache'), None)
+
+    def test_vary(self):
+        english = make_response(
+            request_headers={'Accept-Language': 'en'},
+            Cache_Control='max-age=60', Vary='Accept-Language')
+        french = make_response(
+            request_headers={'Accept-Language': 'fr'},
+            Cache_Control='max-age=60', Vary='Accept-Language')
+        self.cache.store(english)
+        self.cache.store(french)
+        assert_true(self.retrieve(**{'Accept-Language': 'en'}) is english)
+        assert_true(self.retrieve(**{'Accept-Language': 'fr'}) is french)
+        assert_equal(self.retrieve(**{'Accept-Language': 'de'}), None)
+
+    def test_vary_pruned_on_eviction(self):
+        cache = RoboCache(respect_headers=True, max_count=2)
+        for idx in range(4):
+            cache.store(make_response(
+                url='http://robobrowser.com/{0}'.format(idx),
+                request_headers={'Accept-Language': 'en'},
+                Cache_Control='max-age=60', Vary='Accept-Language'))
+        assert_equal(
+            sorted(cache._vary),
+            ['http://robobrowser.com/2', 'http://robobrowser.com/3'])
+        cache.clear()
+        assert_equal(cache._vary, {})
+
+    def test_vary_star(self):
+        self.cache.store(make_response(Cache_Control='max-age=60', Vary='*'))
+        assert_equal(len(self.cache.data), 0)
+
+    def test_browser_requires_cache(self):
+        assert_raises(
+            ValueError, RoboBrowser, cache_respect_headers=True)
+
+
+class TestRevalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FileAdapter(b'<p>queen</p>', headers={
+            'Cache-Control': 'no-cache',
+            'Last-Modified': 'Sun, 06 Nov 1994 08:49:37 GMT',
+        })
+        self.browser = RoboBrowser(cache=True, cache_respect_headers=True)
+
+    def open(self):
+        with serve(self.server):
+            self.browser.open('http://robobrowser.com/')
+        return self.browser.response
+
+    def test_not_modified(self):
+        first = self.open()
+        second = self.open()
+        assert_true(second is first)
+        assert_equal(second.content, b'<p>queen</p>')
+        assert_equal(len(self.server.requests), 2)
+        conditional = self.server.requests[1]
+        assert_equal(conditional.headers['If-None-Match'], '"v1"')
+        assert_equal(
+            conditional.headers['If-Modified-Since'],
+            'Sun, 06 Nov 1994 08:49:37 GMT')
+
+    def test_refresh_freshness(self):
+        first = self.open()
+        self.server.headers['Cache-Control'] = 'max-age=60'
+        self.open()
+        assert_true(self.open() is first)
+        assert_equal(len(self.server.requests), 2)
+
+    def test_modified(self):
+        first = self.open()
+        self.server.etag = '"v2"'
+        self.server.body = b'<p>king</p>'
+        second = self.open()
+        assert_false(second is first)
+        assert_equal(second.content, b'<p>king</p>')
+        assert_equal(self.open().content, b'<p>king</p>')
+
+    def test_evicted_before_not_modified(self):
+        self.open()
+        cache = self.browser.session.adapters['http://'].cache
+        refresh = cache.refresh
+
+        def evict_then_refresh(request, response):
+            cache.clear()
+            return refresh(request, response)
+        cache.refresh = evict_then_refresh
+        response = self.open()
+        assert_equal(response.status_code, 200)
+        assert_equal(response.content, b'<p>queen</p>')
+        assert_equal(len(self.server.requests), 3)
+        assert_false('If-None-Match' in self.server.requests[2].headers)
+
+    def test_validated_entry_outlives_max_age(self):
+        self.browser = RoboBrowser(
+            cache=True, cache_respect_headers=True,
+            max_age=datetime.timedelta(microseconds=1))
+        cache = self.browser.session.adapters['http://'].cache
+        evicted = []
+        cache.on_evict = lambda key, entry, reason: evicted.append(reason)
+        first = self.open()
+        time.sleep(0.01)
+        with serve(self.server):
+            self.browser.open('http://robobrowser.com/other')
+        assert_true(self.open() is first)
+        assert_equal(len(self.server.requests), 3)
+        assert_equal(self.server.requests[2].headers['If-None-Match'], '"v1"')
+        assert_equal(evicted, [])
+
+    def test_stale_without_validators_dropped(self):
+        cache = RoboCache(respect_headers=True)
+        cache.store(make_response(Cache_Control='max-age=60'))
+        key = 'http://robobrowser.com/'
+        cache.data[key]['expires'] = datetime.datetime.now()
+        request = requests.Request('GET', key).prepare()
+        assert_equal(cache.retrieve(request), None)
+        assert_equal(cache.validators(request), None)
+
+
+class SlowFileAdapter(FileAdapter):
+
+    def send(self, request, **kwargs):
+        time.sleep(0.2)
+        return super(SlowFileAdapter, self).send(request, **kwargs)
+
+
+class TestCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SlowFileAdapter(b'<p>queen</p>')
+        self.session = requests.Session()
+        self.session.mount('http://', RoboHTTPAdapter())
+
+    def fetch_concurrently(self, url, count=5):
+        responses = []
+
+        def fetch():
+            try:
+                responses.append(self.session.get(url))
+            except requests.ConnectionError:
+                pass
+
+        threads = [threading.Thread(target=fetch) for _ in range(count)]
+        with serve(self.server):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return responses
+
+    def test_concurrent_misses_coalesced(self):
+        responses = self.fetch_concurrently('http://robobrowser.com/')
+        assert_equal(len(self.server.requests), 1)
+        assert_equal(len(responses), 5)
+        assert_true(all(resp is responses[0] for resp in responses))
+        assert_equal(responses[0].content, b'<p>queen</p>')
+
+    def test_stats_count_each_request_once(self):
+        with serve(self.server):
+            self.session.get('http://robobrowser.com/')
+            self.session.get('http://robobrowser.com/')
+        stats = self.session.adapters['http://'].cache.stats
+        assert_equal(stats.misses, 1)
+        assert_equal(stats.hits, 1)
+
+    def test_distinct_urls_not_coalesced(self):
+        with serve(self.server):
+            self.session.get('http://robobrowser.com/a')
+            self.session.get('http://robobrowser.com/b')
+        assert_equal(len(self.server.requests), 2)
+
+    def test_failed_fetch_retried_by_followers(self):
+        calls = []
+        send = self.server.send
+
+        def flaky(request, **kwargs):
+            calls.append(request)
+            if len(calls) == 1:
+                time.sleep(0.2)
+                raise requests.ConnectionError('reset')
+            return send(request, **kwargs)
+
+        self.server.send = flaky
+        responses = self.fetch_concurrently('http://robobrowser.com/', 3)
+        assert_equal(len(responses), 2)
+        assert_true(len(calls) >= 2)
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+
+    url = 'http://robobrowser.com/'
+
+    def setUp(self):
+        self.server = SlowFileAdapter(b'<p>queen</p>', etag=None)
+        self.adapter = RoboHTTPAdapter(
+            max_age=datetime.timedelta(seconds=60),
+            stale_while_revalidate=datetime.timedelta(seconds=60))
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+
+    def age(self, seconds):
+        entry = self.adapter.cache.data[self.url]
+        entry['date'] -= datetime.timedelta(seconds=seconds)
+
+    def test_stale_served_and_refreshed(self):
+        with serve(self.server):
+            first = self.session.get(self.url)
+            self.age(90)
+            start = time.time()
+            stale = self.session.get(self.url)
+            assert_true(time.time() - start < 0.2)
+            assert_true(stale is first)
+            self.adapter.close()
+        assert_equal(len(self.server.requests), 2)
+        refreshed = self.adapter.cache.data[self.url]['response']
+        assert_false(refreshed is first)
+
+    def test_one_refresh_per_key(self):
+        with serve(self.server):
+            self.session.get(self.url)
+            self.age(90)
+            for _ in range(3):
+                self.session.get(self.url)
+            self.adapter.close()
+        assert_equal(len(self.server.requests), 2)
+
+    def test_past_window_fetched(self):
+        with serve(self.server):
+            first = self.session.get(self.url)
+            self.age(150)
+            second = self.session.get(self.url)
+        assert_false(second is first)
+        assert_equal(len(self.server.requests), 2)
+
+    def test_header_directive(self):
+        cache = RoboCache(respect_headers=True)
+        response = make_response(
+            Cache_Control='max-age=60, stale-while-revalidate=30')
+        cache.store(response)
+        cache.data[self.url]['expires'] -= datetime.timedelta(seconds=80)
+        request = requests.Request('GET', self.url).prepare()
+        assert_equal(cache.retrieve(request), None)
+        assert_true(cache.retrieve_stale(request) is response)
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    url = 'http://robobrowser.com/'
+
+    def setUp(self):
+        self.cache = RoboCache(negative_ttls={
+            404: datetime.timedelta(seconds=30),
+            '5xx': datetime.timedelta(seconds=10),
+        })
+        self.request = requests.Request('GET', self.url).prepare()
+
+    def make_error(self, status_code, **headers):
+        response = make_response(**headers)
+        response.status_code = status_code
+        return response
+
+    def ttl(self):
+        entry = self.cache.data[self.url]
+        return (entry['expires'] - entry['date']).total_seconds()
+
+    def test_off_by_default(self):
+        cache = RoboCache()
+        cache.store(self.make_error(404))
+        assert_equal(len(cache.data), 0)
+
+    def test_code_ttl(self):
+        response = self.make_error(404)
+        self.cache.store(response)
+        assert_true(self.cache.retrieve(self.request) is response)
+        assert_almost_equal(self.ttl(), 30, places=1)
+
+    def test_class_ttl(self):
+        self.cache.store(self.make_error(502))
+        assert_almost_equal(self.ttl(), 10, places=1)
+
+    def test_unlisted_code_not_cached(self):
+        self.cache.store(self.make_error(403))
+        assert_equal(len(self.cache.data), 0)
+
+    def test_retry_after_seconds(self):
+        self.cache.store(self.make_error(503, Retry_After='120'))
+        assert_almost_equal(self.ttl(), 120, places=1)
+
+    def test_retry_after_date(self):
+        response = self.make_error(
+            503, Date='Wed, 21 Oct 2015 07:28:00 GMT',
+            Retry_After='Wed, 21 Oct 2015 07:29:00 GMT')
+        assert_equal(retry_after(response), 60)
+
+    def test_retry_after_only_for_rate_limits(self):
+        self.cache.store(self.make_error(500, Retry_After='120'))
+        assert_almost_equal(self.ttl(), 10, places=1)
+
+    def test_expired_dropped(self):
+        self.cache.store(self.make_error(404, ETag='"v1"'))
+        self.cache.data[self.url]['expires'] -= datetime.timedelta(seconds=60)
+        assert_equal(self.cache.validators(self.request), None)
+        assert_equal(self.cache.retrieve(self.request), None)
+        assert_equal(len(self.cache.data), 0)
+
+    def test_not_served_stale(self):
+        cache = RoboCache(
+            negative_ttls={404: datetime.timedelta(seconds=30)},
+            stale_while_revalidate=datetime.timedelta(seconds=60))
+        cache.store(self.make_error(404))
+        cache.data[self.url]['expires'] -= datetime.timedelta(seconds=40)
+        assert_equal(cache.retrieve_stale(self.request), None)
+
+    def test_header_aware(self):
+        cache = RoboCache(
+            respect_headers=True,
+            negative_ttls={404: datetime.timedelta(seconds=30)})
+        cache.store(self.make_error(404, Cache_Control='no-store'))
+        assert_equal(len(cache.data), 0)
+        cache.store(make_response(
+            request_headers={'Accept-Language': 'en'},
+            Cache_Control='max-age=60', Vary='Accept-Language'))
+        response = self.make_error(404, Vary='Accept-Language')
+        response.request.headers['Accept-Language'] = 'fr'
+        cache.store(response)
+        request = requests.Request(
+            'GET', self.url, headers={'Accept-Language': 'fr'}).prepare()
+        assert_true(cache.retrieve(request) is response)
+        assert_equal(len(cache.data), 2)
+
+    def test_adapter_serves_negative_entries(self):
+        server = FileAdapter(b'', etag=None, status=429)
+        adapter = RoboHTTPAdapter(
+            negative_ttls={'4xx': datetime.timedelta(seconds=30)})
+        session = requests.Session()
+        session.mount('http://', adapter)
+        with serve(server):
+            for _ in range(3):
+                assert_equal(session.get(self.url).status_code, 429)
+        assert_equal(len(server.requests), 1)
+
+
+class TestCompression(unittest.TestCase):
+
+    body = b'<p>queen</p>' * 1000
+
+    def setUp(self):
+        self.cache = RoboCache(compression='zlib')
+        self.request = requests.Request('GET', 'http://robobrowser.com/')
+
+    def store(self):
+        response = make_response()
+        response._content = self.body
+        self.cache.store(response)
+        return response
+
+    def test_stored_compressed(self):
+        self.store()
+        stored = self.cache.data['http://robobrowser.com/']
+        assert_true(stored['size'] < len(self.body) / 10)
+        assert_equal(self.cache._bytes, stored['size'])
+        assert_true(self.cache.stats.compression_ratio > 10)
+        assert_equal(self.cache.stats.compressed, 1)
+
+    def test_lazy_decompression(self):
+        self.store()
+        hit = self.cache.retrieve(self.request.prepare())
+        assert_true(hit._content is False)
+        assert_equal(self.cache.stats.decompress_time, 0)
+        assert_equal(hit.content, self.body)
+        assert_equal(hit.text, self.body.decode('utf-8'))
+        assert_equal(b''.join(hit.iter_content(100)), self.body)
+        # Reading a hit doesn't decompress the stored copy
+        stored = self.cache.data['http://robobrowser.com/']['response']
+        assert_true(stored._content is False)
+
+    def test_uncacheable_not_compressed(self):
+        self.cache = RoboCache(compression='zlib', respect_headers=True)
+        response = make_response(Cache_Control='no-store, max-age=60')
+        response._content = self.body
+        self.cache.store(response)
+        assert_equal(len(self.cache.data), 0)
+        assert_equal(self.cache.stats.compressed, 0)
+
+    def test_invalid_codec(self):
+        assert_raises(ValueError, RoboCache, compression='bogus')
+
+
+class TestKeyNormalizer(unittest.TestCase):
+
+    def test_sort_query(self):
+        normalize = KeyNormalizer()
+        assert_equal(
+            normalize('http://robobrowser.com/?b=2&a=1'),
+            'http://robobrowser.com/?a=1&b=2')
+
+    def test_drop_params(self):
+        normalize = KeyNormalizer(drop_params=['utm_*', 'sid'])
+        assert_equal(
+            normalize('http://robobrowser.com/?utm_source=x&a=1&sid=abc'),
+            'http://robobrowser.com/?a=1')
+
+    def test_scheme_host_port(self):
+        normalize = KeyNormalizer()
+        assert_equal(
+            normalize('HTTP://User@RoboBrowser.COM:80/Path'),
+            'http://User@robobrowser.com/Path')
+        assert_equal(
+            normalize('https://robobrowser.com:8443/'),
+            'https://robobrowser.com:8443/')
+
+    def test_key_func(self):
+        normalize = KeyNormalizer(key_func=lambda url: url.rstrip('/'))
+        assert_equal(
+            normalize('http://robobrowser.com/'), 'http://robobrowser.com')
+
+    def test_normalized_hits(self):
+        cache = RoboCache(normalize=True)
+        response = make_response('http://robobrowser.com/?a=1&b=2')
+        cache.store(response)
+        request = requests.Request(
+            'GET', 'http://ROBOBROWSER.com/?b=2&utm_medium=x&a=1').prepare()
+        assert_true(cache.retrieve(request) is response)
+        assert_equal(cache.stats.normalized_hits, 1)
+        request = requests.Request('GET', response.url).prepare()
+        cache.retrieve(request)
+        assert_equal(cache.stats.normalized_hits, 1)
+
+
+class TestPolicies(unittest.TestCase):
+
+    def setUp(self):
+        self.static = CachePolicy(max_age=datetime.timedelta(days=7))
+        self.search = CachePolicy(max_count=1)
+        self.matcher = PolicyMatcher([
+            ('http://robobrowser.com/', self.search),
+            ('http://robobrowser.com/static/', self.static),
+            (re.compile(r'https?://[^/]+/login'), None),
+        ])
+
+    def test_longest_prefix(self):
+        assert_true(
+            self.matcher.match('http://robobrowser.com/static/a.css')
+            is self.static)
+        assert_true(
+            self.matcher.match('http://robobrowser.com/search?q=a')
+            is self.search)
+        assert_equal(self.matcher.match('http://example.com/'), None)
+
+    def test_regex_first(self):
+        assert_equal(self.matcher.match('http://robobrowser.com/login'), None)
+
+    def test_flagged_patterns(self):
+        first, second, third = CachePolicy(), CachePolicy(), CachePolicy()
+        matcher = PolicyMatcher([
+            (re.compile(r'http://EXAMPLE\.com/', re.I), first),
+            (re.compile(r'(?i)http://robobrowser\.com/A'), second),
+            (re.compile(r'(?i)http://robobrowser\.com/'), third),
+        ])
+        assert_true(matcher.match('http://example.com/') is first)
+        assert_true(matcher.match('http://robobrowser.com/a') is second)
+        assert_true(matcher.match('http://ROBOBROWSER.com/b') is third)
+
+    def test_grouped_patterns(self):
+        first, second, third = CachePolicy(), CachePolicy(), CachePolicy()
+        matcher = PolicyMatcher([
+            (re.compile(r'http://a\.com/'), first),
+            (re.compile(r'http://(\w+)\.com/\1/'), second),
+            (re.compile(r'http://b\.com/'), third),
+        ])
+        assert_true(matcher.match('http://a.com/x/') is first)
+        assert_true(matcher.match('http://x.com/x/') is second)
+        assert_equal(matcher.match('http://x.com/y/'), None)
+        assert_true(matcher.match('http://b.com/') is third)
+
+    def test_many_patterns(self):
+        policies = [CachePolicy() for _ in range(500)]
+        matcher = PolicyMatcher(dict(
+            ('http://host{0}.com/'.format(idx), policy)
+            for idx, policy in enumerate(policies)
+        ))
+        assert_true(matcher.match('http://host321.com/page') is policies[321])
+        assert_equal(len(matcher._lengths), 3)
+
+    def test_adapter_routes_by_policy(self):
+        server = FileAdapter(b'<p>queen</p>')
+        browser = RoboBrowser(cache=True, cache_patterns=self.matcher)
+        with serve(server):
+            for url in ('http://robobrowser.com/static/a.css',
+                        'http://robobrowser.com/login'):
+                browser.open(url)
+                browser.open(url)
+        assert_equal(len(server.requests), 3)
+        adapter = browser.session.adapters['http://']
+        static = adapter.cache_for('http://robobrowser.com/static/a.css')
+        search = adapter.cache_for('http://robobrowser.com/search')
+        assert_equal(len(static.data), 1)
+        assert_equal(len(search.data), 0)
+
+    def test_policy_budget(self):
+        adapter = RoboHTTPAdapter(policies=self.matcher)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        with serve(FileAdapter(b'<p>queen</p>')):
+            session.get('http://robobrowser.com/a')
+            session.get('http://robobrowser.com/b')
+        cache = adapter.cache_for('http://robobrowser.com/a')
+        assert_equal(list(cache.data.keys()), ['http://robobrowser.com/b'])
+
+    def test_policies_shared_between_adapters(self):
+        first = RoboHTTPAdapter(policies=self.matcher)
+        second = RoboHTTPAdapter(policies=self.matcher)
+        url = 'http://robobrowser.com/static/a.css'
+        assert_false(first.cache_for(url) is second.cache_for(url))
+        assert_false(hasattr(self.static, 'cache'))
+
+    def test_policy_verbs(self):
+        server = FileAdapter(b'<p>queen</p>')
+        session = requests.Session()
+        adapter = RoboHTTPAdapter(policies={'http://': CachePolicy(
+            verbs=['GET', 'HEAD'], codes=[200])})
+        session.mount('http://', adapter)
+        with serve(server):
+            session.head('http://robobrowser.com/')
+            session.get('http://robobrowser.com/')
+            session.head('http://robobrowser.com/')
+            session.post('http://robobrowser.com/')
+        assert_equal(
+            [request.method for request in server.requests],
+            ['HEAD', 'GET', 'POST'])
+
+
+class TestTieredCache(unittest.TestCase):
+
+    def setUp(self):
+        self.l2 = RoboCache()
+        self.cache = TieredCache(RoboCache(max_count=2), self.l2)
+
+    def request(self, idx):
+        return requests.Request(
+            'GET', 'http://robobrowser.com/{0}'.format(idx)).prepare()
+
+    def store(self, idx):
+        response = make_response('http://robobrowser.com/{0}'.format(idx))
+        self.cache.store(response)
+        return response
+
+    def test_eviction_demotes(self):
+        for idx in range(3):
+            self.store(idx)
+        assert_equal(len(self.cache.l1.data), 2)
+        assert_equal(list(self.l2.data.keys()), ['http://robobrowser.com/0'])
+
+    def test_hit_promotes(self):
+        first = self.store(0)
+        self.store(1)
+        self.store(2)
+        assert_true(self.cache.retrieve(self.request(0)) is first)
+        assert_true('http://robobrowser.com/0' in self.cache.l1.data)
+        # Promotion copied the entry and evicted the least recently used
+        # L1 entry to L2
+        assert_equal(
+            list(self.l2.data.keys()),
+            ['http://robobrowser.com/0', 'http://robobrowser.com/1'])
+        assert_equal(self.cache.l1.stats.misses, 1)
+        assert_equal(self.l2.stats.hits, 1)
+
+    def test_counters(self):
+        self.store(0)
+        self.cache.retrieve(self.request(0))
+        self.cache.retrieve(self.request(9))
+        assert_equal(self.cache.l1.stats.hits, 1)
+        assert_equal(self.cache.l1.stats.misses, 1)
+        assert_equal(self.l2.stats.hits, 0)
+        assert_equal(self.l2.stats.misses, 1)
+
+    def test_demotion_replaces_copy(self):
+        self.store(0)
+        self.cache.flush()
+        self.cache.retrieve(self.request(0))
+        updated = self.store(0)
+        self.cache.flush()
+        assert_equal(list(self.l2.data.keys()), ['http://robobrowser.com/0'])
+        assert_true(self.cache.retrieve(self.request(0)) is updated)
+
+    def test_promotion_keeps_date(self):
+        self.store(0)
+        date = self.cache.l1.data['http://robobrowser.com/0']['date']
+        self.cache.flush()
+        assert_equal(len(self.cache.l1.data), 0)
+        self.cache.retrieve(self.request(0))
+        assert_equal(
+            self.cache.l1.data['http://robobrowser.com/0']['date'], date)
+
+    def test_browser_uses_tiered_cache(self):
+        server = FileAdapter(b'<p>queen</p>')
+        browser = RoboBrowser(cache=self.cache)
+        with serve(server):
+            browser.open('http://robobrowser.com/')
+            browser.open('http://robobrowser.com/')
+        assert_equal(len(server.requests), 1)
+        assert_equal(self.cache.l1.stats.hits, 1)
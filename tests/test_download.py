@@ -0,0 +1,325 @@
+import unittest
+from nose.tools import *  # noqa
+
+import io
+import os
+import json
+import zlib
+import shutil
+import hashlib
+import tempfile
+
+import requests
+from bs4 import BeautifulSoup
+
+from robobrowser.browser import RoboBrowser
+from robobrowser.exceptions import RoboError
+
+from tests.utils import FileAdapter
+
+
+class TestDownload(unittest.TestCase):
+
+    body = b''.join(bytes(bytearray([idx % 256])) for idx in range(10000))
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'queen.bin')
+        self.adapter = FileAdapter(self.body)
+        self.browser = RoboBrowser()
+        self.browser.session.mount('http://', self.adapter)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self):
+        with open(self.path, 'rb') as fp:
+            return fp.read()
+
+    def test_download_link(self):
+        link = BeautifulSoup(
+            '<a href="http://robobrowser.com/queen.bin">file</a>').find('a')
+        result = self.browser.download(link, self.path, chunk_size=1000)
+        assert_equal(self.read(), self.body)
+        assert_equal(result.size, len(self.body))
+        assert_equal(result.total, len(self.body))
+        assert_equal(result.checksum, hashlib.sha256(self.body).hexdigest())
+        assert_false(result.resumed)
+        assert_false(os.path.exists(self.path + '.resume'))
+
+    def test_progress_callback(self):
+        progress = []
+        self.browser.download(
+            'http://robobrowser.com/queen.bin', self.path, chunk_size=4000,
+            callback=lambda result: progress.append(result.size))
+        assert_equal(progress, [4000, 8000, 10000])
+
+    def write_partial(self, length, etag='"v1"'):
+        with open(self.path, 'wb') as fp:
+            fp.write(self.body[:length])
+        with open(self.path + '.resume', 'w') as fp:
+            fp.write(json.dumps({'validator': etag}))
+
+    def test_resume(self):
+        self.write_partial(2500)
+        result = self.browser.download(
+            'http://robobrowser.com/queen.bin', self.path, resume=True)
+        request = self.adapter.requests[0]
+        assert_equal(request.headers['Range'], 'bytes=2500-')
+        assert_equal(request.headers['If-Range'], '"v1"')
+        assert_true(result.resumed)
+        assert_equal(result.transferred, len(self.body) - 2500)
+        assert_equal(self.read(), self.body)
+        assert_equal(result.checksum, hashlib.sha256(self.body).hexdigest())
+
+    def test_resume_changed_resource(self):
+        self.write_partial(2500, etag='"v0"')
+        result = self.browser.download(
+            'http://robobrowser.com/queen.bin', self.path, resume=True)
+        assert_false(result.resumed)
+        assert_equal(result.transferred, len(self.body))
+        assert_equal(self.read(), self.body)
+
+    def test_resume_complete_file(self):
+        self.write_partial(len(self.body))
+        result = self.browser.download(
+            'http://robobrowser.com/queen.bin', self.path, resume=True)
+        assert_equal(result.transferred, 0)
+        assert_equal(result.size, len(self.body))
+        assert_equal(result.checksum, hashlib.sha256(self.body).hexdigest())
+
+    def test_resume_without_validator_restarts(self):
+        with open(self.path, 'wb') as fp:
+            fp.write(b'garbage')
+        self.browser.download(
+            'http://robobrowser.com/queen.bin', self.path, resume=True)
+        assert_false('Range' in self.adapter.requests[0].headers)
+        assert_equal(self.read(), self.body)
+
+
+class GzipFileAdapter(FileAdapter):
+    """Serves the payload gzipped to clients that accept it, with byte
+    ranges counting encoded bytes.
+
+    """
+    def send(self, request, **kwargs):
+        if 'gzip' not in request.headers.get('Accept-Encoding', ''):
+            return super(GzipFileAdapter, self).send(request, **kwargs)
+        body = self.body
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        self.body = compressor.compress(body) + compressor.flush()
+        self.headers['Content-Encoding'] = 'gzip'
+        try:
+            return super(GzipFileAdapter, self).send(request, **kwargs)
+        finally:
+            self.body = body
+            del self.headers['Content-Encoding']
+
+
+class TestEncodedDownload(unittest.TestCase):
+
+    body = b'queen' * 40000
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'queen.bin')
+        self.adapter = GzipFileAdapter(self.body)
+        self.browser = RoboBrowser()
+        self.browser.session.mount('http://', self.adapter)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_resume_unencoded(self):
+        with open(self.path, 'wb') as fp:
+            fp.write(self.body[:50000])
+        with open(self.path + '.resume', 'w') as fp:
+            fp.write(json.dumps({'validator': '"v1"'}))
+        result = self.browser.download(
+            'http://robobrowser.com/queen.bin', self.path, resume=True)
+        assert_true(result.resumed)
+        assert_equal(
+            self.adapter.requests[0].headers['Accept-Encoding'], 'identity')
+        with open(self.path, 'rb') as fp:
+            assert_equal(fp.read(), self.body)
+
+    def test_gzipped_download(self):
+        result = self.browser.download(
+            'http://robobrowser.com/queen.bin', self.path)
+        assert_equal(result.size, len(self.body))
+        assert_equal(result.total, None)
+
+    def test_short_download_raises(self):
+        send = self.adapter.send
+
+        def send_short(request, **kwargs):
+            response = send(request, **kwargs)
+            response.raw = io.BytesIO(response.raw.read()[:-10])
+            return response
+        self.adapter.send = send_short
+        assert_raises(
+            RoboError, self.browser.download,
+            'http://robobrowser.com/queen.bin', self.path, resume=True)
+        assert_true(os.path.exists(self.path + '.resume'))
+
+    def test_download_all_skips_gzipped_current_files(self):
+        url = 'http://robobrowser.com/queen.bin'
+        self.browser.download_all([url], self.tempdir)
+        self.adapter.etag = None
+        results = self.browser.download_all([url], self.tempdir)
+        assert_true(results[0].skipped)
+
+
+class TestSegmentedDownload(unittest.TestCase):
+
+    body = TestDownload.body
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'queen.bin')
+        self.browser = RoboBrowser()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def download(self, adapter, **kwargs):
+        self.browser.session.mount('http://', adapter)
+        result = self.browser.download(
+            'http://robobrowser.com/queen.bin', self.path, chunk_size=512,
+            **kwargs)
+        with open(self.path, 'rb') as fp:
+            assert_equal(fp.read(), self.body)
+        assert_equal(result.checksum, hashlib.sha256(self.body).hexdigest())
+        return result
+
+    def test_segments(self):
+        adapter = FileAdapter(self.body)
+        result = self.download(adapter, segments=3)
+        assert_equal(result.segments, 3)
+        assert_equal(result.size, len(self.body))
+        ranges = sorted(
+            request.headers['Range'] for request in adapter.requests
+            if request.method == 'GET'
+        )
+        assert_equal(
+            ranges, ['bytes=0-3333', 'bytes=3334-6667', 'bytes=6668-9999'])
+        assert_equal(adapter.requests[0].method, 'HEAD')
+
+    def test_segments_progress(self):
+        progress = []
+        self.download(
+            FileAdapter(self.body), segments=4,
+            callback=lambda result: progress.append(result.size))
+        assert_equal(progress[-1], len(self.body))
+        assert_equal(progress, sorted(progress))
+
+    def test_fallback_without_ranges(self):
+        adapter = FileAdapter(self.body, accept_ranges=False)
+        result = self.download(adapter, segments=3)
+        assert_equal(result.segments, 1)
+        assert_equal(len(adapter.requests), 2)
+
+    def test_fallback_when_resource_changes(self):
+        adapter = FileAdapter(self.body)
+        send = adapter.send
+
+        def send_then_change(request, **kwargs):
+            response = send(request, **kwargs)
+            adapter.etag = '"v2"'
+            return response
+        adapter.send = send_then_change
+        result = self.download(adapter, segments=3)
+        assert_equal(result.segments, 1)
+        assert_equal(result.transferred, len(self.body))
+
+    def test_fallback_on_short_segment(self):
+        adapter = FileAdapter(self.body)
+        send = adapter.send
+
+        def send_short(request, **kwargs):
+            response = send(request, **kwargs)
+            if response.status_code == 206:
+                response.raw = io.BytesIO(response.raw.read()[:-10])
+            return response
+        adapter.send = send_short
+        result = self.download(adapter, segments=3)
+        assert_equal(result.segments, 1)
+        assert_equal(result.transferred, len(self.body))
+
+
+class BrokenAdapter(requests.adapters.HTTPAdapter):
+
+    def send(self, request, **kwargs):
+        raise requests.exceptions.ConnectionError(request.url)
+
+
+class TestDownloadAll(unittest.TestCase):
+
+    body = TestDownload.body
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.adapter = FileAdapter(self.body)
+        self.browser = RoboBrowser()
+        self.browser.session.mount('http://', self.adapter)
+        self.urls = [
+            'http://robobrowser.com/files/a.bin',
+            'http://robobrowser.com/files/a.bin#fragment',
+            'http://robobrowser.com/other/a.bin',
+            'http://robobrowser.com/files/',
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_download_all(self):
+        results = self.browser.download_all(
+            self.urls, self.tempdir, max_workers=2)
+        assert_equal(len(results), 3)
+        assert_true(all(result.ok for result in results))
+        assert_equal(
+            [os.path.basename(result.path) for result in results],
+            ['a.bin', 'a-1.bin', 'index']
+        )
+        for result in results:
+            assert_equal(result.size, len(self.body))
+            with open(result.path, 'rb') as fp:
+                assert_equal(fp.read(), self.body)
+        assert_equal(
+            sorted(os.listdir(self.tempdir)),
+            ['.robobrowser-downloads.json', 'a-1.bin', 'a.bin', 'index']
+        )
+
+    def test_skips_current_files(self):
+        self.browser.download_all(self.urls, self.tempdir)
+        results = self.browser.download_all(self.urls, self.tempdir)
+        assert_true(all(result.skipped for result in results))
+        assert_true(all(result.transferred == 0 for result in results))
+
+    def test_refetches_changed_files(self):
+        self.browser.download_all(self.urls[:1], self.tempdir)
+        self.adapter.etag = '"v2"'
+        results = self.browser.download_all(self.urls[:1], self.tempdir)
+        assert_false(results[0].skipped)
+        assert_equal(results[0].transferred, len(self.body))
+
+    def test_refetches_file_of_other_url(self):
+        self.browser.download_all(self.urls[:1], self.tempdir)
+        self.adapter.body = b'king' * len(self.body)
+        self.adapter.etag = '"v2"'
+        results = self.browser.download_all(self.urls[2:3], self.tempdir)
+        assert_false(results[0].skipped)
+        with open(results[0].path, 'rb') as fp:
+            assert_equal(fp.read(), self.adapter.body)
+        with open(os.path.join(
+                self.tempdir, '.robobrowser-downloads.json')) as fp:
+            manifest = json.load(fp)
+        assert_equal(list(manifest), [self.urls[2]])
+
+    def test_reports_errors(self):
+        self.browser.session.mount('http://broken', BrokenAdapter())
+        results = self.browser.download_all(
+            ['http://broken.robobrowser.com/x.bin'] + self.urls[:1],
+            self.tempdir)
+        assert_false(results[0].ok)
+        assert_true(results[1].ok)
@@ -0,0 +1,57 @@
+import unittest
+from nose.tools import *  # noqa
+
+from robobrowser.pool import RoboBrowserPool
+from robobrowser.cache import RoboHTTPAdapter
+
+from tests.fixtures import mock_urls
+
+
+class TestPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = RoboBrowserPool(pool_maxsize=4, tries=3)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_browsers_isolated(self):
+        browser1 = self.pool.browser()
+        browser2 = self.pool.browser()
+        assert_true(browser1.session is not browser2.session)
+        assert_true(browser1.session.cookies is not browser2.session.cookies)
+        assert_true(browser1._states is not browser2._states)
+
+    def test_browsers_share_connections(self):
+        browser1 = self.pool.browser()
+        browser2 = self.pool.browser()
+        assert_true(
+            browser1.session.adapters['http://'] is
+            browser2.session.adapters['http://']
+        )
+        assert_equal(self.pool.adapter.max_retries.total, 3)
+
+    def test_caching_browser_shares_connections(self):
+        browser = self.pool.browser(cache=True)
+        adapter = browser.session.adapters['http://']
+        assert_true(isinstance(adapter, RoboHTTPAdapter))
+        assert_true(adapter.poolmanager is self.pool.adapter.poolmanager)
+        assert_equal(adapter.max_retries.total, 3)
+
+    def test_browser_rejects_retries(self):
+        assert_raises(ValueError, lambda: self.pool.browser(tries=2))
+
+    @mock_urls
+    def test_map(self):
+        def visit(browser, page):
+            browser.open('http://robobrowser.com/page{0}/'.format(page))
+            return browser.url
+        results = self.pool.map(visit, [1, 2, 3, 5], max_workers=2)
+        assert_equal([result.job for result in results], [1, 2, 3, 5])
+        assert_equal(
+            [result.result for result in results[:3]],
+            ['http://robobrowser.com/page{0}/'.format(idx) for idx in [1, 2, 3]]
+        )
+        assert_true(all(result.ok for result in results[:3]))
+        assert_false(results[3].ok)
+        assert_true(all(result.elapsed >= 0 for result in results))
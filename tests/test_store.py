@@ -0,0 +1,78 @@
+import unittest
+from nose.tools import *  # noqa
+
+import os
+import shutil
+import tempfile
+
+import requests
+
+from robobrowser.store import StateStore
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'history.bin')
+        self.store = StateStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tempdir)
+
+    def make_response(self, body):
+        response = requests.Response()
+        response.url = 'http://robobrowser.com/'
+        response.status_code = 200
+        response.reason = 'OK'
+        response.encoding = 'utf-8'
+        response.headers['Content-Type'] = 'text/html'
+        response._content = body
+        return response
+
+    def test_roundtrip(self):
+        record = self.store.append(self.make_response(b'<p>mercury</p>'))
+        loaded = self.store.load(record)
+        assert_equal(loaded.content, b'<p>mercury</p>')
+        assert_equal(loaded.status_code, 200)
+        assert_equal(loaded.url, 'http://robobrowser.com/')
+        assert_equal(loaded.encoding, 'utf-8')
+        assert_equal(loaded.headers['content-type'], 'text/html')
+
+    def test_load_after_append(self):
+        first = self.store.append(self.make_response(b'may'))
+        assert_equal(self.store.load(first).content, b'may')
+        second = self.store.append(self.make_response(b'taylor'))
+        assert_equal(self.store.load(second).content, b'taylor')
+        assert_equal(self.store.load(first).content, b'may')
+
+    def test_reopen_rebuilds_index(self):
+        self.store.append(self.make_response(b'deacon'))
+        self.store.append(self.make_response(b''))
+        self.store.close()
+        self.store = StateStore(self.path)
+        assert_equal(len(self.store), 2)
+        assert_equal(self.store.load(0).content, b'deacon')
+        assert_equal(self.store.load(1).content, b'')
+
+    def test_reopen_truncated(self):
+        self.store.append(self.make_response(b'deacon'))
+        self.store.close()
+        self.store = StateStore(self.path, truncate=True)
+        assert_equal(len(self.store), 0)
+        record = self.store.append(self.make_response(b'john'))
+        assert_equal(record, 0)
+        assert_equal(self.store.load(record).content, b'john')
+
+    def test_ignores_truncated_record(self):
+        self.store.append(self.make_response(b'deacon'))
+        self.store.close()
+        with open(self.path, 'ab') as fp:
+            fp.write(b'\x00\x00\x00\x10')
+        self.store = StateStore(self.path)
+        assert_equal(len(self.store), 1)
+        record = self.store.append(self.make_response(b'john'))
+        self.store.close()
+        self.store = StateStore(self.path)
+        assert_equal(self.store.load(record).content, b'john')
@@ -1,5 +1,10 @@
+import io
+import mock
 import functools
 
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.response import HTTPResponse
+
 from robobrowser import responses
 from robobrowser.compat import iteritems
 
@@ -40,3 +45,68 @@ def mock_responses(resps):
             return func(*args, **kwargs)
         return wrapped
     return wrapper
+
+
+class FileAdapter(HTTPAdapter):
+    """Transport adapter serving a fixed payload for any URL, honoring
+    `Range`, `If-Range` and `If-None-Match` request headers. Used to test
+    downloads and caching.
+
+    """
+    def __init__(self, body, etag='"v1"', accept_ranges=True, headers=None,
+                 status=200, **kwargs):
+        super(FileAdapter, self).__init__(**kwargs)
+        self.body = body
+        self.status = status
+        self.etag = etag
+        self.accept_ranges = accept_ranges
+        self.headers = headers or {}
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        headers = {'Content-Type': 'application/octet-stream'}
+        if self.etag:
+            headers['ETag'] = self.etag
+        headers.update(self.headers)
+        if self.accept_ranges:
+            headers['Accept-Ranges'] = 'bytes'
+        status, body = self.status, self.body
+        if self.etag and request.headers.get('If-None-Match') == self.etag:
+            status, body = 304, b''
+        byte_range = request.headers.get('Range')
+        if_range = request.headers.get('If-Range')
+        if (status == 200 and byte_range and self.accept_ranges and
+                if_range in (None, self.etag)):
+            start, end = byte_range.split('=')[1].split('-')
+            start = int(start)
+            end = int(end) if end else len(self.body) - 1
+            if start >= len(self.body):
+                status, body = 416, b''
+                headers['Content-Range'] = 'bytes */{0}'.format(len(self.body))
+            else:
+                status, body = 206, self.body[start:end + 1]
+                headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+                    start, start + len(body) - 1, len(self.body))
+        headers['Content-Length'] = str(len(body))
+        if request.method == 'HEAD':
+            body = b''
+        raw = HTTPResponse(
+            status=status,
+            body=io.BytesIO(body),
+            headers=headers,
+            preload_content=False,
+            request_method=request.method,
+        )
+        return self.build_response(request, raw)
+
+
+def serve(adapter):
+    """Patch the network transport of all adapters, including caching
+    adapters, to answer with `adapter`.
+
+    """
+    return mock.patch.object(
+        HTTPAdapter, 'send',
+        lambda self, request, **kwargs: adapter.send(request, **kwargs)
+    )